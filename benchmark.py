@@ -0,0 +1,329 @@
+"""Synthetic load generator and benchmark for every command path.
+
+Generates (or reuses) a synthetic playtime database, then calls the slash
+command handlers from main.py and GoalChecker.check_goals directly with a
+stub Interaction. Latency percentiles, SQL statements issued and peak Python
+memory are reported per command and written as JSON so runs can be compared:
+
+    python benchmark.py --rows 1000000 --output before.json
+    python benchmark.py --rows 1000000 --output after.json --compare before.json
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import sqlite3
+import statistics
+import subprocess
+import time
+import tracemalloc
+import discord
+import numpy as np
+import main
+from cache import ImageCache
+from cogs.goal_checker import GoalChecker
+from database import Database
+from directory import UserDirectory
+from rendering import ChartRenderer
+from throttle import SingleFlight
+
+GENERATE_CHUNK = 200_000
+
+
+def generate_dataset(path: str, rows: int, users: int, days: int, seed: int):
+    """Fill ``path`` with ``rows`` submissions spread over ``users`` and the last ``days`` days.
+
+    User activity is heavy-tailed (a few players submit most of the rows),
+    submissions cluster towards recent days, and session lengths are
+    log-normal, which is roughly what the production table looks like.
+    """
+    rng = np.random.default_rng(seed)
+    user_ids = 100_000_000_000_000_000 + np.arange(users, dtype=np.int64) * 7919
+    weights = 1 / np.arange(1, users + 1) ** 0.8
+    weights /= weights.sum()
+    today = datetime.date.today().toordinal()
+
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.executemany(
+        "INSERT OR REPLACE INTO users (user_id, username) VALUES (?, ?)",
+        ((int(user_id), f"player{i}") for i, user_id in enumerate(user_ids))
+    )
+    # The playtime triggers would multiply the cost of every row; the caller
+    # runs rebuild_aggregates once afterwards instead.
+    triggers = conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'playtime'"
+    ).fetchall()
+    for name, _ in triggers:
+        conn.execute(f"DROP TRIGGER {name}")
+    conn.commit()
+    try:
+        written = 0
+        while written < rows:
+            n = min(GENERATE_CHUNK, rows - written)
+            chunk_users = user_ids[rng.choice(users, size=n, p=weights)]
+            days_ago = np.minimum(rng.exponential(days / 3, size=n), days - 1).astype(np.int64)
+            hours = np.clip(rng.lognormal(0.7, 0.6, size=n), 0.1, 16).round(2)
+            conn.executemany(
+                "INSERT INTO playtime (user_id, day, playtime) VALUES (?, ?, ?)",
+                zip(chunk_users.tolist(), (today - days_ago).tolist(), hours.tolist())
+            )
+            conn.commit()
+            written += n
+            print(f"  {written:,}/{rows:,} rows", end="\r", flush=True)
+        print()
+    finally:
+        for _, sql in triggers:
+            conn.execute(sql)
+        conn.commit()
+        conn.close()
+
+
+def make_user(user_id: int, name: str) -> discord.User:
+    return discord.User(state=None, data={
+        "id": user_id, "username": name, "discriminator": "0", "avatar": None, "global_name": None,
+    })
+
+
+class StubUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+
+    async def send(self, *args, **kwargs):
+        pass
+
+
+class StubResponse:
+    def __init__(self):
+        self.done = False
+
+    async def defer(self, **kwargs):
+        self.done = True
+
+    def is_done(self) -> bool:
+        return self.done
+
+    async def send_message(self, *args, **kwargs):
+        self.done = True
+
+    async def edit_message(self, **kwargs):
+        self.done = True
+
+
+class StubFollowup:
+    def __init__(self):
+        self.messages = []
+
+    async def send(self, content=None, **kwargs):
+        self.messages.append(content)
+
+
+class StubInteraction:
+    def __init__(self, client, user: discord.User):
+        self.client = client
+        self.user = user
+        self.guild = None
+        self.guild_id = None
+        self.extras = {}
+        self.response = StubResponse()
+        self.followup = StubFollowup()
+
+
+class StubClient:
+    """The parts of PlaytimeBot the command handlers and GoalChecker touch."""
+
+    def __init__(self, path: str):
+        self.db = Database(path)
+        self.renderer = ChartRenderer()
+        self.chart_cache = ImageCache()
+        self.directory = UserDirectory(self.db)
+        self.single_flight = SingleFlight()
+        self.goal_checker = None
+        self.shard_ids = None
+        self.shard_count = None
+
+    def dispatch(self, event: str, *args):
+        listener = getattr(self.goal_checker, f"on_{event}", None)
+        if listener is not None:
+            asyncio.create_task(listener(*args))
+
+    async def create_dm(self, user):
+        return StubUser(user.id)
+
+    def get_partial_messageable(self, channel_id: int, **kwargs):
+        return StubUser(channel_id)
+
+    async def wait_until_ready(self):
+        pass
+
+    async def is_owner(self, user) -> bool:
+        return True
+
+
+def scenarios(client: StubClient, user_ids):
+    heavy, typical, other = user_ids[0], user_ids[len(user_ids) // 2], user_ids[1]
+    me = make_user(heavy, "player0")
+    team = [make_user(user_id, f"player{i}") for i, user_id in enumerate(user_ids[:10])]
+
+    def call(command, *args):
+        return lambda: command.callback(StubInteraction(client, me), *args)
+
+    async def reset_chart_cache():
+        client.chart_cache = ImageCache()
+
+    async def seed_goals():
+        await client.db.execute(
+            "INSERT OR REPLACE INTO goals (user_id, goal) SELECT user_id, 1.0 FROM user_totals"
+        )
+        await client.db.execute(
+            "INSERT OR IGNORE INTO goal_checks (user_id, day) SELECT user_id, MAX(day) FROM daily_totals GROUP BY user_id"
+        )
+
+    # (name, run, setup) - setup runs before every iteration and isn't timed.
+    return [
+        ("submit", call(main.submit, 1.5), None),
+        ("setgoal", call(main.setgoal, 5.0), None),
+        ("remindme", call(main.remindme), None),
+        ("streak", call(main.streak), None),
+        ("graph_user", call(main.graph, me), reset_chart_cache),
+        ("graph_all", call(main.graph), reset_chart_cache),
+        ("graph_all_cached", call(main.graph), None),
+        ("compare", call(main.compare, me, make_user(typical, "typical")), reset_chart_cache),
+        ("compare_10_rolling", call(main.compare, *team, None, None, "day", "rolling"), reset_chart_cache),
+        ("leaderboard", call(main.leaderboard), None),
+        ("leaderboard_week", call(main.leaderboard, "week"), None),
+        ("exportdata", call(main.exportdata), None),
+        ("exportdata_other", call(main.exportdata, make_user(other, "other")), None),
+        ("check_goals", lambda: client.goal_checker.check_goals(), seed_goals),
+    ]
+
+
+def percentile(samples, q: int) -> float:
+    if len(samples) < 2:
+        return samples[0]
+    return statistics.quantiles(samples, n=100, method="inclusive")[q - 1]
+
+
+async def measure(client: StubClient, run, setup, iterations: int, warmup: int):
+    for _ in range(warmup):
+        if setup:
+            await setup()
+        await run()
+
+    latencies = []
+    statements = 0
+    for _ in range(iterations):
+        if setup:
+            await setup()
+        before = client.db.statements
+        began = time.perf_counter()
+        await run()
+        latencies.append((time.perf_counter() - began) * 1000)
+        statements += client.db.statements - before
+
+    # Memory is measured on a separate call; tracing would distort the timings.
+    if setup:
+        await setup()
+    tracemalloc.start()
+    await run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "p50_ms": percentile(latencies, 50),
+        "p90_ms": percentile(latencies, 90),
+        "p99_ms": percentile(latencies, 99),
+        "mean_ms": statistics.fmean(latencies),
+        "statements": statements / iterations,
+        "peak_kib": peak / 1024,
+    }
+
+
+def git_version() -> str:
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_results(results, baseline=None):
+    print(f"{'command':<20}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'stmts':>8}{'peak KiB':>10}")
+    for name, stats in results["commands"].items():
+        line = (f"{name:<20}{stats['p50_ms']:>10.2f}{stats['p90_ms']:>10.2f}{stats['p99_ms']:>10.2f}"
+                f"{stats['statements']:>8.1f}{stats['peak_kib']:>10.1f}")
+        old = (baseline or {}).get("commands", {}).get(name)
+        if old:
+            line += f"   p50 {stats['p50_ms'] / old['p50_ms'] - 1:+.0%} vs {baseline['version']}"
+        print(line)
+
+
+async def run(args):
+    client = StubClient(args.db)
+    fresh = args.regenerate or not os.path.exists(args.db)
+    if fresh and os.path.exists(args.db):
+        os.remove(args.db)
+
+    await client.db.open()
+    try:
+        if fresh:
+            print(f"Generating {args.rows:,} rows for {args.users:,} users over {args.days} days...")
+            await client.db.close()
+            generate_dataset(args.db, args.rows, args.users, args.days, args.seed)
+            await client.db.open()
+            await client.db.rebuild_aggregates()
+        rows = await client.db.fetchall("SELECT user_id FROM user_totals ORDER BY total DESC")
+        user_ids = [row[0] for row in rows]
+        dataset = (await client.db.fetchone("SELECT COUNT(*) FROM playtime"))[0]
+
+        client.renderer.start()
+        client.goal_checker = GoalChecker(client)
+        client.goal_checker.check_goals.cancel()
+
+        results = {
+            "version": git_version(),
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "dataset": {"rows": dataset, "users": len(user_ids)},
+            "iterations": args.iterations,
+            "commands": {},
+        }
+        for name, runner, setup in scenarios(client, user_ids):
+            if args.only and name not in args.only:
+                continue
+            print(f"  {name}...", end="\r", flush=True)
+            results["commands"][name] = await measure(client, runner, setup, args.iterations, args.warmup)
+        print()
+    finally:
+        client.renderer.close()
+        await client.db.close()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+    print_results(results, baseline)
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=2)
+    print(f"Results written to {args.output}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default="bench.db", help="Database file to benchmark against (default: bench.db)")
+    parser.add_argument("--rows", type=int, default=100_000, help="Rows to generate (default: 100000)")
+    parser.add_argument("--users", type=int, default=5_000, help="Distinct users to generate (default: 5000)")
+    parser.add_argument("--days", type=int, default=730, help="Days of history to generate (default: 730)")
+    parser.add_argument("--seed", type=int, default=20, help="Random seed for the generator")
+    parser.add_argument("--regenerate", action="store_true", help="Rebuild the dataset even if --db exists")
+    parser.add_argument("--iterations", type=int, default=30, help="Timed calls per command (default: 30)")
+    parser.add_argument("--warmup", type=int, default=2, help="Untimed calls per command first (default: 2)")
+    parser.add_argument("--only", nargs="+", help="Only run these commands")
+    parser.add_argument("--output", default="bench_results.json", help="Where to write the JSON results")
+    parser.add_argument("--compare", help="Earlier results JSON to compare against")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,37 @@
+import collections
+import hashlib
+import os
+
+CHART_CACHE_BYTES = int(os.getenv("CHART_CACHE_BYTES", 32 * 1024 * 1024))
+
+
+def cache_key(*parts) -> str:
+    """Hash the parameters that fully determine a chart into a cache key."""
+    return hashlib.sha256(repr(parts).encode()).hexdigest()
+
+
+class ImageCache:
+    """LRU cache of rendered PNGs, bounded by total size in bytes."""
+
+    def __init__(self, max_bytes: int = CHART_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._images = collections.OrderedDict()
+
+    def get(self, key: str):
+        png = self._images.get(key)
+        if png is not None:
+            self._images.move_to_end(key)
+        return png
+
+    def put(self, key: str, png: bytes):
+        if len(png) > self.max_bytes:
+            return
+        old = self._images.pop(key, None)
+        if old is not None:
+            self.size -= len(old)
+        self._images[key] = png
+        self.size += len(png)
+        while self.size > self.max_bytes:
+            _, evicted = self._images.popitem(last=False)
+            self.size -= len(evicted)
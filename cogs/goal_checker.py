@@ -1,11 +1,23 @@
 import discord
 from discord.ext import commands, tasks
-import aiosqlite
+import asyncio
 import datetime
+import logging
+from metrics import metrics
 
-DATABASE = 'playtime.db'
+log = logging.getLogger(__name__)
+
+# How many congratulation DMs the sweep sends at once. discord.py already waits
+# out 429s; this just keeps a big sweep from queueing thousands of requests.
+DM_CONCURRENCY = 5
 
 class GoalChecker(commands.Cog):
+    """Congratulates users when their daily total reaches their goal.
+
+    Goals are checked as soon as a submission lands (see on_playtime_submitted);
+    check_goals is only a slow safety net for anything the event path missed.
+    """
+
     def __init__(self, bot: commands.Bot):
         self.bot = bot
         self.check_goals.start()
@@ -13,40 +25,49 @@ class GoalChecker(commands.Cog):
     def cog_unload(self):
         self.check_goals.cancel()
 
-    @tasks.loop(minutes=.01) 
+    async def dm_channel(self, user_id: int) -> discord.abc.Messageable:
+        """The user's DM channel, opening it (one HTTP call, ever) only if the directory doesn't know it."""
+        channel_id = await self.bot.directory.dm_channel_id(user_id)
+        if channel_id is None:
+            channel = await self.bot.create_dm(discord.Object(user_id))
+            await self.bot.directory.remember_dm_channel(user_id, channel.id)
+            return channel
+        return self.bot.get_partial_messageable(channel_id, type=discord.ChannelType.private)
+
+    async def congratulate(self, user_id: int, goal: float, total_playtime: float):
+        try:
+            channel = await self.dm_channel(user_id)
+            await channel.send(
+                f"Congratulations! You've reached your daily playtime goal of {goal} hours today "
+                f"with a total of {total_playtime:.2f} hours. Your goal has been cleared. Set a new one with `/setgoal` if you'd like!"
+            )
+        except Exception as e:
+            log.warning("Failed to DM user %s: %s", user_id, e)
+
+    @commands.Cog.listener()
+    async def on_playtime_submitted(self, user_id: int, date: datetime.date, daily_total: float):
+        if date != await self.bot.directory.today(user_id):
+            return
+        # Claiming deletes the goal only if it is met, so the sweep and this
+        # listener can never both congratulate the same user.
+        with metrics.timer("playtime_goal_check_seconds"):
+            goal = await self.bot.db.claim_goal(user_id, daily_total)
+        if goal is not None:
+            await self.congratulate(user_id, goal, daily_total)
+
+    @tasks.loop(minutes=15)
     async def check_goals(self):
-        today = datetime.date.today().strftime("%Y-%m-%d")
-        async with aiosqlite.connect(DATABASE) as db:
-            async with db.execute("SELECT user_id, goal FROM goals") as cursor:
-                goals = await cursor.fetchall()
-
-            for user_id, goal in goals:
-                async with db.execute(
-                    "SELECT SUM(playtime) FROM playtime WHERE user_id = ? AND date = ?",
-                    (user_id, today)
-                ) as cursor:
-                    row = await cursor.fetchone()
-                total_playtime = row[0] if row and row[0] is not None else 0
-
-                if total_playtime >= goal:
-                    user = self.bot.get_user(user_id)
-                    if user is None:
-                        try:
-                            user = await self.bot.fetch_user(user_id)
-                        except Exception as e:
-                            print(f"Failed to fetch user {user_id}: {e}")
-                            continue
-
-                    try:
-                        await user.send(
-                            f"Congratulations! You've reached your daily playtime goal of {goal} hours today "
-                            f"with a total of {total_playtime:.2f} hours. Your goal has been cleared. Set a new one with `/setgoal` if you'd like!"
-                        )
-                    except Exception as e:
-                        print(f"Failed to DM user {user_id}: {e}")
-
-                    await db.execute("DELETE FROM goals WHERE user_id = ?", (user_id,))
-            await db.commit()
+        with metrics.timer("playtime_goal_sweep_seconds"):
+            # shard_ids is None when this process runs every shard, which sweeps everyone.
+            met = await self.bot.db.claim_met_goals(self.bot.shard_ids, self.bot.shard_count)
+            semaphore = asyncio.Semaphore(DM_CONCURRENCY)
+
+            async def send(user_id, goal, total_playtime):
+                async with semaphore:
+                    await self.congratulate(user_id, goal, total_playtime)
+
+            await asyncio.gather(*(send(*row) for row in met))
+        metrics.increment("playtime_goals_met_total", len(met))
 
     @check_goals.before_loop
     async def before_check_goals(self):
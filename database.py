@@ -0,0 +1,882 @@
+import asyncio
+import contextlib
+import datetime
+import json
+import time
+import aiosqlite
+from metrics import SqlStats, current_sql, metrics
+from storage import DATABASE, EXPORT_CHUNK_SIZE, STREAKS_QUERY, Storage, due_goals, from_day, prepare_bulk, to_day
+
+READERS = 4
+# Concurrent /submit calls arriving within this window share one commit.
+WRITE_BATCH_DELAY = 0.005
+STATEMENT_CACHE_SIZE = 256
+
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA busy_timeout = 5000",
+)
+
+# Each entry upgrades the schema by one version; PRAGMA user_version records
+# how many have been applied. Never edit a shipped migration, append a new one.
+MIGRATIONS = (
+    # 1: the original schema. Files created before migrations existed already
+    # have these tables, so this is a no-op for them.
+    (
+        '''
+        CREATE TABLE IF NOT EXISTS playtime (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            username TEXT,
+            playtime REAL,
+            date TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS goals (
+            user_id INTEGER PRIMARY KEY,
+            goal REAL
+        )
+        ''',
+    ),
+    # 2: integer day numbers, usernames moved to their own table, indexes.
+    (
+        '''
+        CREATE TABLE users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT
+        )
+        ''',
+        '''
+        INSERT INTO users (user_id, username)
+        SELECT user_id, username FROM playtime
+        WHERE id IN (SELECT MAX(id) FROM playtime GROUP BY user_id)
+        ''',
+        '''
+        CREATE TABLE playtime_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            day INTEGER NOT NULL,
+            playtime REAL NOT NULL
+        )
+        ''',
+        # julianday('0001-01-01') is 1721425.5, which is day 1 for date.toordinal().
+        # The original /submit also stored dates without zero padding, which
+        # julianday() can't read; legacy_day() parses those in Python.
+        '''
+        INSERT INTO playtime_new (id, user_id, day, playtime)
+        SELECT id, user_id, COALESCE(CAST(julianday(date) - 1721424.5 AS INTEGER), legacy_day(date)), playtime
+        FROM playtime
+        ''',
+        "DROP TABLE playtime",
+        "ALTER TABLE playtime_new RENAME TO playtime",
+        "CREATE INDEX playtime_user_day ON playtime (user_id, day, playtime)",
+        "CREATE INDEX playtime_day ON playtime (day, playtime)",
+    ),
+    # 3: rollup tables kept up to date by triggers on playtime.
+    (
+        '''
+        CREATE TABLE daily_totals (
+            user_id INTEGER NOT NULL,
+            day INTEGER NOT NULL,
+            total REAL NOT NULL,
+            PRIMARY KEY (user_id, day)
+        ) WITHOUT ROWID
+        ''',
+        "CREATE INDEX daily_totals_day ON daily_totals (day, user_id, total)",
+        '''
+        CREATE TABLE user_totals (
+            user_id INTEGER PRIMARY KEY,
+            total REAL NOT NULL
+        )
+        ''',
+        "CREATE INDEX user_totals_rank ON user_totals (total DESC, user_id)",
+        '''
+        CREATE TABLE day_totals (
+            day INTEGER PRIMARY KEY,
+            total REAL NOT NULL
+        )
+        ''',
+        '''
+        CREATE TRIGGER playtime_insert AFTER INSERT ON playtime BEGIN
+            INSERT INTO daily_totals (user_id, day, total) VALUES (NEW.user_id, NEW.day, NEW.playtime)
+            ON CONFLICT (user_id, day) DO UPDATE SET total = total + excluded.total;
+            INSERT INTO user_totals (user_id, total) VALUES (NEW.user_id, NEW.playtime)
+            ON CONFLICT (user_id) DO UPDATE SET total = total + excluded.total;
+            INSERT INTO day_totals (day, total) VALUES (NEW.day, NEW.playtime)
+            ON CONFLICT (day) DO UPDATE SET total = total + excluded.total;
+        END
+        ''',
+        '''
+        CREATE TRIGGER playtime_delete AFTER DELETE ON playtime BEGIN
+            UPDATE daily_totals SET total = total - OLD.playtime WHERE user_id = OLD.user_id AND day = OLD.day;
+            UPDATE user_totals SET total = total - OLD.playtime WHERE user_id = OLD.user_id;
+            UPDATE day_totals SET total = total - OLD.playtime WHERE day = OLD.day;
+        END
+        ''',
+        '''
+        INSERT INTO daily_totals (user_id, day, total)
+        SELECT user_id, day, SUM(playtime) FROM playtime GROUP BY user_id, day
+        ''',
+        '''
+        INSERT INTO user_totals (user_id, total)
+        SELECT user_id, SUM(playtime) FROM playtime GROUP BY user_id
+        ''',
+        '''
+        INSERT INTO day_totals (day, total)
+        SELECT day, SUM(playtime) FROM playtime GROUP BY day
+        ''',
+    ),
+    # 4: small key/value store for bot state that must survive restarts.
+    (
+        '''
+        CREATE TABLE settings (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+        ''',
+    ),
+    # 5: per-user streak state, maintained by add_playtime.
+    (
+        '''
+        CREATE TABLE streaks (
+            user_id INTEGER PRIMARY KEY,
+            last_day INTEGER NOT NULL,
+            current INTEGER NOT NULL,
+            longest INTEGER NOT NULL
+        )
+        ''',
+        "CREATE INDEX streaks_longest ON streaks (longest DESC, user_id)",
+        "CREATE INDEX streaks_current ON streaks (current DESC, user_id)",
+        '''
+        INSERT INTO streaks (user_id, last_day, current, longest)
+        WITH islands AS (
+            SELECT user_id, day, day - ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY day) AS island
+            FROM daily_totals
+        ), runs AS (
+            SELECT user_id, MAX(day) AS last_day, COUNT(*) AS length
+            FROM islands GROUP BY user_id, island
+        ), ranked AS (
+            SELECT user_id, last_day, length,
+                   MAX(length) OVER (PARTITION BY user_id) AS longest,
+                   ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY last_day DESC) AS recency
+            FROM runs
+        )
+        SELECT user_id, last_day, length, longest FROM ranked WHERE recency = 1
+        ''',
+    ),
+    # 6: weekly and monthly rollups and guild membership for leaderboards.
+    (
+        '''
+        CREATE TABLE period_totals (
+            period TEXT NOT NULL,
+            start_day INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            total REAL NOT NULL,
+            PRIMARY KEY (period, start_day, user_id)
+        ) WITHOUT ROWID
+        ''',
+        "CREATE INDEX period_totals_rank ON period_totals (period, start_day, total DESC, user_id)",
+        "DROP INDEX daily_totals_day",
+        "CREATE INDEX daily_totals_rank ON daily_totals (day, total DESC, user_id)",
+        '''
+        CREATE TABLE guild_members (
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            PRIMARY KEY (guild_id, user_id)
+        ) WITHOUT ROWID
+        ''',
+        "DROP TRIGGER playtime_insert",
+        "DROP TRIGGER playtime_delete",
+        # Weeks start on Monday (day 1 is Monday 0001-01-01); months start on
+        # the 1st, found by reading the day of month off the julian day number.
+        '''
+        CREATE TRIGGER playtime_insert AFTER INSERT ON playtime BEGIN
+            INSERT INTO daily_totals (user_id, day, total) VALUES (NEW.user_id, NEW.day, NEW.playtime)
+            ON CONFLICT (user_id, day) DO UPDATE SET total = total + excluded.total;
+            INSERT INTO user_totals (user_id, total) VALUES (NEW.user_id, NEW.playtime)
+            ON CONFLICT (user_id) DO UPDATE SET total = total + excluded.total;
+            INSERT INTO day_totals (day, total) VALUES (NEW.day, NEW.playtime)
+            ON CONFLICT (day) DO UPDATE SET total = total + excluded.total;
+            INSERT INTO period_totals (period, start_day, user_id, total)
+            VALUES ('week', NEW.day - (NEW.day - 1) % 7, NEW.user_id, NEW.playtime)
+            ON CONFLICT (period, start_day, user_id) DO UPDATE SET total = total + excluded.total;
+            INSERT INTO period_totals (period, start_day, user_id, total)
+            VALUES ('month', NEW.day - CAST(strftime('%d', NEW.day + 1721424.5) AS INTEGER) + 1, NEW.user_id, NEW.playtime)
+            ON CONFLICT (period, start_day, user_id) DO UPDATE SET total = total + excluded.total;
+        END
+        ''',
+        '''
+        CREATE TRIGGER playtime_delete AFTER DELETE ON playtime BEGIN
+            UPDATE daily_totals SET total = total - OLD.playtime WHERE user_id = OLD.user_id AND day = OLD.day;
+            UPDATE user_totals SET total = total - OLD.playtime WHERE user_id = OLD.user_id;
+            UPDATE day_totals SET total = total - OLD.playtime WHERE day = OLD.day;
+            UPDATE period_totals SET total = total - OLD.playtime
+            WHERE period = 'week' AND start_day = OLD.day - (OLD.day - 1) % 7 AND user_id = OLD.user_id;
+            UPDATE period_totals SET total = total - OLD.playtime
+            WHERE period = 'month' AND start_day = OLD.day - CAST(strftime('%d', OLD.day + 1721424.5) AS INTEGER) + 1
+            AND user_id = OLD.user_id;
+        END
+        ''',
+        '''
+        INSERT INTO period_totals (period, start_day, user_id, total)
+        SELECT 'week', day - (day - 1) % 7 AS start_day, user_id, SUM(total)
+        FROM daily_totals GROUP BY start_day, user_id
+        ''',
+        '''
+        INSERT INTO period_totals (period, start_day, user_id, total)
+        SELECT 'month', day - CAST(strftime('%d', day + 1721424.5) AS INTEGER) + 1 AS start_day, user_id, SUM(total)
+        FROM daily_totals GROUP BY start_day, user_id
+        ''',
+    ),
+    # 7: remember each user's DM channel so goal DMs never need fetch_user.
+    (
+        "ALTER TABLE users ADD COLUMN dm_channel_id INTEGER",
+    ),
+    # 8: per-user timezones, and a queue of (user, day) pairs the goal sweep
+    # has to look at, filled as users with a goal get playtime.
+    (
+        "ALTER TABLE users ADD COLUMN timezone TEXT",
+        '''
+        CREATE TABLE goal_checks (
+            user_id INTEGER NOT NULL,
+            day INTEGER NOT NULL,
+            PRIMARY KEY (user_id, day)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TRIGGER playtime_goal_check AFTER INSERT ON playtime
+        WHEN EXISTS (SELECT 1 FROM goals WHERE user_id = NEW.user_id) BEGIN
+            INSERT OR IGNORE INTO goal_checks (user_id, day) VALUES (NEW.user_id, NEW.day);
+        END
+        ''',
+        '''
+        INSERT INTO goal_checks (user_id, day)
+        SELECT goals.user_id, MAX(daily_totals.day) FROM goals
+        JOIN daily_totals ON daily_totals.user_id = goals.user_id
+        GROUP BY goals.user_id
+        ''',
+    ),
+    # 9: a per-user data version in the database, so every process sharing
+    # it can tell when its cached charts are stale.
+    (
+        "ALTER TABLE users ADD COLUMN version INTEGER NOT NULL DEFAULT 0",
+        '''
+        CREATE TRIGGER playtime_version_insert AFTER INSERT ON playtime BEGIN
+            UPDATE users SET version = version + 1 WHERE user_id = NEW.user_id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER playtime_version_delete AFTER DELETE ON playtime BEGIN
+            UPDATE users SET version = version + 1 WHERE user_id = OLD.user_id;
+        END
+        ''',
+    ),
+    # 10: one data version for everyone, so the all-users token doesn't have
+    # to add up every user's.
+    (
+        "CREATE TABLE data_version (version INTEGER NOT NULL)",
+        "INSERT INTO data_version (version) SELECT COALESCE(SUM(version), 0) FROM users",
+        "DROP TRIGGER playtime_version_insert",
+        "DROP TRIGGER playtime_version_delete",
+        '''
+        CREATE TRIGGER playtime_version_insert AFTER INSERT ON playtime BEGIN
+            UPDATE users SET version = version + 1 WHERE user_id = NEW.user_id;
+            UPDATE data_version SET version = version + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER playtime_version_delete AFTER DELETE ON playtime BEGIN
+            UPDATE users SET version = version + 1 WHERE user_id = OLD.user_id;
+            UPDATE data_version SET version = version + 1;
+        END
+        ''',
+    ),
+)
+
+# Regenerates the rollup tables from the raw playtime rows.
+REBUILD_AGGREGATES = (
+    "DELETE FROM daily_totals",
+    "DELETE FROM user_totals",
+    "DELETE FROM day_totals",
+    '''
+    INSERT INTO daily_totals (user_id, day, total)
+    SELECT user_id, day, SUM(playtime) FROM playtime GROUP BY user_id, day
+    ''',
+    '''
+    INSERT INTO user_totals (user_id, total)
+    SELECT user_id, SUM(playtime) FROM playtime GROUP BY user_id
+    ''',
+    '''
+    INSERT INTO day_totals (day, total)
+    SELECT day, SUM(playtime) FROM playtime GROUP BY day
+    ''',
+    "DELETE FROM period_totals",
+    '''
+    INSERT INTO period_totals (period, start_day, user_id, total)
+    SELECT 'week', day - (day - 1) % 7 AS start_day, user_id, SUM(total)
+    FROM daily_totals GROUP BY start_day, user_id
+    ''',
+    '''
+    INSERT INTO period_totals (period, start_day, user_id, total)
+    SELECT 'month', day - CAST(strftime('%d', day + 1721424.5) AS INTEGER) + 1 AS start_day, user_id, SUM(total)
+    FROM daily_totals GROUP BY start_day, user_id
+    ''',
+    "DELETE FROM streaks",
+    "INSERT INTO streaks (user_id, last_day, current, longest) " + STREAKS_QUERY.format(where=""),
+    "UPDATE users SET version = version + 1",
+    "UPDATE data_version SET version = version + 1",
+)
+
+
+# SQL for the first day (as a day number) of the bucket each ``day`` falls in.
+BUCKETS = {
+    "day": "day",
+    "week": "day - (day - 1) % 7",
+    "month": "day - CAST(strftime('%d', day + 1721424.5) AS INTEGER) + 1",
+}
+
+
+def _legacy_day(date: str) -> int:
+    """Day number of a date as the original /submit stored it, e.g. '2025-3-4'."""
+    return to_day(datetime.datetime.strptime(date, "%Y-%m-%d").date())
+
+
+def _ranking_source(window: str, today: datetime.date, guild_id: int = None):
+    """Return the FROM clause, WHERE clause and parameters for ranking users in ``window``.
+
+    Every source exposes ``t.user_id`` and ``t.total`` and is backed by an index
+    ordered by total, so pages and ranks never aggregate raw rows.
+    """
+    day = to_day(today)
+    if window == "all":
+        source, where, params = "user_totals t", "1", []
+    elif window == "today":
+        source, where, params = "daily_totals t", "t.day = ?", [day]
+    elif window == "week":
+        source, where, params = "period_totals t", "t.period = 'week' AND t.start_day = ?", [day - (day - 1) % 7]
+    elif window == "month":
+        source, where, params = "period_totals t", "t.period = 'month' AND t.start_day = ?", [to_day(today.replace(day=1))]
+    else:
+        raise ValueError(f"Unknown leaderboard window {window!r}")
+
+    if guild_id is not None:
+        source += " JOIN guild_members g ON g.user_id = t.user_id AND g.guild_id = ?"
+        params.insert(0, guild_id)
+    return source, where, params
+
+
+class Database(Storage):
+    """SQLite storage: a long-lived connection pool shared by every command and cog.
+
+    Writes go through a single connection guarded by a lock, so they are
+    serialized the same way SQLite serializes them anyway. Reads are spread
+    over a few read-only connections, which WAL mode lets run alongside the
+    writer.
+    """
+
+    def __init__(self, path: str = DATABASE, readers: int = READERS):
+        super().__init__()
+        self.path = path
+        self.reader_count = readers
+        self._writer = None
+        # Made in open(): before Python 3.10 these bind to the event loop current
+        # when they are created, and the bot builds its storage before bot.run().
+        self._readers = None
+        self._all_readers = []
+        self._write_lock = None
+        self._pending_writes = []
+        self._flush_task = None
+        # Every statement SQLite runs on any pooled connection, including BEGIN/COMMIT and trigger bodies.
+        self.statements = 0
+
+    async def _connect(self) -> aiosqlite.Connection:
+        # isolation_level=None leaves transaction control to transaction(),
+        # cached_statements keeps prepared statements around between calls.
+        conn = await aiosqlite.connect(
+            self.path,
+            isolation_level=None,
+            cached_statements=STATEMENT_CACHE_SIZE,
+        )
+        for pragma in PRAGMAS:
+            await conn.execute(pragma)
+        await conn.set_trace_callback(self._count_statement)
+        return conn
+
+    def _count_statement(self, sql: str):
+        self.statements += 1
+
+    async def open(self):
+        self._readers = asyncio.Queue()
+        self._write_lock = asyncio.Lock()
+        self._writer = await self._connect()
+        try:
+            await self.initialize()
+        except BaseException:
+            # Otherwise the connection's thread keeps the process alive after the error.
+            await self._writer.close()
+            self._writer = None
+            raise
+        for _ in range(self.reader_count):
+            conn = await self._connect()
+            await conn.execute("PRAGMA query_only = ON")
+            self._all_readers.append(conn)
+            self._readers.put_nowait(conn)
+
+    async def close(self):
+        if self._flush_task is not None:
+            await self._flush_task
+        for conn in self._all_readers:
+            await conn.close()
+        self._all_readers.clear()
+        if self._writer is not None:
+            await self._writer.execute("PRAGMA optimize")
+            await self._writer.close()
+            self._writer = None
+
+    async def initialize(self):
+        await self._writer.create_function("legacy_day", 1, _legacy_day, deterministic=True)
+        async with self.transaction() as db:
+            async with db.execute("PRAGMA user_version") as cursor:
+                version = (await cursor.fetchone())[0]
+            for number, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+                for statement in statements:
+                    await db.execute(statement)
+                await db.execute(f"PRAGMA user_version = {number}")
+        # Every migration commits together, so only report them once they have.
+        if version < len(MIGRATIONS):
+            print(f"Migrated {self.path} from schema version {version} to {len(MIGRATIONS)}.")
+
+    @contextlib.asynccontextmanager
+    async def transaction(self):
+        async with self._write_lock:
+            began = time.perf_counter()
+            try:
+                await self._writer.execute("BEGIN IMMEDIATE")
+                try:
+                    yield self._writer
+                except BaseException:
+                    await self._writer.execute("ROLLBACK")
+                    raise
+                # COMMIT is where the fsync happens, so it counts too.
+                await self._writer.execute("COMMIT")
+            finally:
+                metrics.record_query(time.perf_counter() - began)
+
+    @contextlib.asynccontextmanager
+    async def reader(self):
+        conn = await self._readers.get()
+        began = time.perf_counter()
+        try:
+            yield conn
+        finally:
+            metrics.record_query(time.perf_counter() - began)
+            self._readers.put_nowait(conn)
+
+    async def fetchone(self, sql: str, params=()):
+        async with self.reader() as conn:
+            async with conn.execute(sql, params) as cursor:
+                return await cursor.fetchone()
+
+    async def fetchall(self, sql: str, params=()):
+        async with self.reader() as conn:
+            async with conn.execute(sql, params) as cursor:
+                return await cursor.fetchall()
+
+    async def execute(self, sql: str, params=()):
+        async with self.transaction() as db:
+            await db.execute(sql, params)
+
+    async def data_version(self, user_ids=None):
+        if user_ids is None:
+            row = await self.fetchone("SELECT version FROM data_version")
+        else:
+            user_ids = list(user_ids)
+            row = await self.fetchone(
+                f"SELECT COALESCE(SUM(version), 0) FROM users WHERE user_id IN ({', '.join('?' * len(user_ids))})",
+                user_ids
+            )
+        return row[0]
+
+    # Playtime
+
+    async def add_playtime(self, user_id: int, username: str, playtime: float, date: datetime.date,
+                           guild_id: int = None) -> float:
+        """Record a submission and return the user's new total for that day.
+
+        Submissions are queued and committed together with any others that
+        arrive within WRITE_BATCH_DELAY, so a burst costs one fsync.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._pending_writes.append(((user_id, username, playtime, date, guild_id), future, current_sql.get()))
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_writes())
+        return await future
+
+    async def _flush_writes(self):
+        await asyncio.sleep(WRITE_BATCH_DELAY)
+        pending, self._pending_writes = self._pending_writes, []
+        self._flush_task = None
+        # This task inherited the context of whichever submission started it.
+        # Count the batch on its own instead, and charge all of it to every
+        # submission that waited on it.
+        batch = SqlStats()
+        current_sql.set(batch)
+
+        try:
+            async with self.transaction() as db:
+                totals = [await self._insert_playtime(db, *args) for args, _, _ in pending]
+        except Exception:
+            # Don't let one bad submission fail everyone else's: retry them one by one.
+            results = []
+            for args, _, _ in pending:
+                try:
+                    async with self.transaction() as db:
+                        results.append((await self._insert_playtime(db, *args), None))
+                except Exception as e:
+                    results.append((None, e))
+        else:
+            results = [(total, None) for total in totals]
+
+        for (_, future, stats), (total, error) in zip(pending, results):
+            # A submitter that was cancelled meanwhile has nobody left to tell.
+            if future.done():
+                continue
+            if stats is not None:
+                stats.queries += batch.queries
+                stats.seconds += batch.seconds
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(total)
+
+    async def _insert_playtime(self, db: aiosqlite.Connection, user_id: int, username: str, playtime: float,
+                               date: datetime.date, guild_id: int = None) -> float:
+        await db.execute(
+            "INSERT INTO users (user_id, username) VALUES (?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET username = excluded.username",
+            (user_id, username)
+        )
+        if guild_id is not None:
+            await db.execute(
+                "INSERT OR IGNORE INTO guild_members (guild_id, user_id) VALUES (?, ?)", (guild_id, user_id)
+            )
+        await db.execute(
+            "INSERT INTO playtime (user_id, day, playtime) VALUES (?, ?, ?)",
+            (user_id, to_day(date), playtime)
+        )
+        async with db.execute(
+            "SELECT total FROM daily_totals WHERE user_id = ? AND day = ?", (user_id, to_day(date))
+        ) as cursor:
+            daily_total = (await cursor.fetchone())[0]
+        await self._update_streak(db, user_id, to_day(date), new_day=daily_total == playtime)
+        return daily_total
+
+    async def add_playtime_bulk(self, rows, guild_id: int = None):
+        """Replace the days ``rows`` cover with them in one transaction; see Storage.add_playtime_bulk.
+
+        Every row is validated before anything is written, so a bad row
+        rejects the whole batch with a ValueError naming it.
+        """
+        usernames, prepared, days = prepare_bulk(rows)
+        async with self.transaction() as db:
+            await db.executemany(
+                "INSERT INTO users (user_id, username) VALUES (?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET username = excluded.username",
+                usernames.items()
+            )
+            if guild_id is not None:
+                await db.executemany(
+                    "INSERT OR IGNORE INTO guild_members (guild_id, user_id) VALUES (?, ?)",
+                    ((guild_id, user_id) for user_id in usernames)
+                )
+            # rowcount leaves out the trigger writes, so it counts replaced submissions only.
+            cursor = await db.executemany("DELETE FROM playtime WHERE user_id = ? AND day = ?", days)
+            replaced = cursor.rowcount
+            await db.executemany("INSERT INTO playtime (user_id, day, playtime) VALUES (?, ?, ?)", prepared)
+            await db.executemany(
+                "REPLACE INTO streaks (user_id, last_day, current, longest) "
+                + STREAKS_QUERY.format(where="WHERE user_id = ?"),
+                ((user_id,) for user_id in usernames)
+            )
+        return len(prepared), replaced
+
+    async def _update_streak(self, db: aiosqlite.Connection, user_id: int, day: int, new_day: bool):
+        async with db.execute(
+            "SELECT last_day, current, longest FROM streaks WHERE user_id = ?", (user_id,)
+        ) as cursor:
+            row = await cursor.fetchone()
+
+        if row is None:
+            await db.execute(
+                "INSERT INTO streaks (user_id, last_day, current, longest) VALUES (?, ?, 1, 1)", (user_id, day)
+            )
+            return
+
+        last_day, current, longest = row
+        if day == last_day or (day < last_day and not new_day):
+            return
+        if day > last_day:
+            current = current + 1 if day == last_day + 1 else 1
+            await db.execute(
+                "UPDATE streaks SET last_day = ?, current = ?, longest = ? WHERE user_id = ?",
+                (day, current, max(longest, current), user_id)
+            )
+            return
+        # A backfilled day can join or split runs anywhere in the history, so
+        # recompute this user's runs from their daily totals instead.
+        await db.execute(
+            "REPLACE INTO streaks (user_id, last_day, current, longest) "
+            + STREAKS_QUERY.format(where="WHERE user_id = ?"),
+            (user_id,)
+        )
+
+    async def daily_total(self, user_id: int, date: datetime.date) -> float:
+        row = await self.fetchone(
+            "SELECT total FROM daily_totals WHERE user_id = ? AND day = ?", (user_id, to_day(date))
+        )
+        return row[0] if row else 0
+
+    async def totals_by_period(self, user_id: int = None, start: datetime.date = None,
+                               end: datetime.date = None, granularity: str = "day"):
+        """Playtime summed per day, week or month as (first day number, total) rows in order.
+
+        Bucketing happens in SQL so a chart over years of history only ships a
+        few hundred rows out of the database. ``start``/``end`` bound the days
+        included; buckets at the edges only cover the days inside the range.
+        """
+        bucket = BUCKETS[granularity]
+        clauses, params = [], []
+        if user_id is not None:
+            source = "daily_totals"
+            clauses.append("user_id = ?")
+            params.append(user_id)
+        else:
+            source = "day_totals"
+        if start is not None:
+            clauses.append("day >= ?")
+            params.append(to_day(start))
+        if end is not None:
+            clauses.append("day <= ?")
+            params.append(to_day(end))
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        if granularity == "day":
+            query = f"SELECT day, total FROM {source} {where} ORDER BY day"
+        else:
+            query = f"SELECT {bucket} AS bucket, SUM(total) FROM {source} {where} GROUP BY bucket ORDER BY bucket"
+        return await self.fetchall(query, params)
+
+    async def totals_by_period_for(self, user_ids, start: datetime.date = None, end: datetime.date = None,
+                                   granularity: str = "day"):
+        """totals_by_period for several users in one query, as (user_id, first day number, total) rows."""
+        bucket = BUCKETS[granularity]
+        clauses = [f"user_id IN ({', '.join('?' * len(user_ids))})"]
+        params = list(user_ids)
+        if start is not None:
+            clauses.append("day >= ?")
+            params.append(to_day(start))
+        if end is not None:
+            clauses.append("day <= ?")
+            params.append(to_day(end))
+        return await self.fetchall(
+            f"SELECT user_id, {bucket} AS bucket, SUM(total) FROM daily_totals WHERE {' AND '.join(clauses)} "
+            "GROUP BY user_id, bucket ORDER BY user_id, bucket",
+            params
+        )
+
+    async def get_users(self, user_ids):
+        return await self.fetchall(
+            "SELECT user_id, username, dm_channel_id, timezone FROM users "
+            f"WHERE user_id IN ({', '.join('?' * len(user_ids))})",
+            list(user_ids)
+        )
+
+    async def rename_user(self, user_id: int, username: str):
+        await self.execute(
+            "UPDATE users SET username = ? WHERE user_id = ? AND username IS NOT ?", (username, user_id, username)
+        )
+
+    async def set_dm_channel(self, user_id: int, channel_id: int):
+        await self.execute("UPDATE users SET dm_channel_id = ? WHERE user_id = ?", (channel_id, user_id))
+
+    async def set_timezone(self, user_id: int, username: str, timezone: str):
+        await self.execute(
+            "INSERT INTO users (user_id, username, timezone) VALUES (?, ?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET username = excluded.username, timezone = excluded.timezone",
+            (user_id, username, timezone)
+        )
+
+    async def get_streak(self, user_id: int):
+        """Return (current, longest) for the user, or None if they never submitted.
+
+        ``current`` is the run of days ending on their most recent submission.
+        """
+        return await self.fetchone("SELECT current, longest FROM streaks WHERE user_id = ?", (user_id,))
+
+    async def streak_leaderboard(self, limit: int, active_since: datetime.date = None):
+        """Top users by longest streak, or by current streak if ``active_since`` is given.
+
+        Only streaks whose last day is on or after ``active_since`` count as current.
+        """
+        if active_since is None:
+            return await self.fetchall(
+                "SELECT users.username, streaks.longest FROM streaks "
+                "JOIN users ON users.user_id = streaks.user_id "
+                "ORDER BY streaks.longest DESC, streaks.user_id LIMIT ?",
+                (limit,)
+            )
+        return await self.fetchall(
+            "SELECT users.username, streaks.current FROM streaks "
+            "JOIN users ON users.user_id = streaks.user_id "
+            "WHERE streaks.last_day >= ? "
+            "ORDER BY streaks.current DESC, streaks.user_id LIMIT ?",
+            (to_day(active_since), limit)
+        )
+
+    async def leaderboard(self, window: str, today: datetime.date, limit: int, guild_id: int = None,
+                          after=None):
+        """Return up to ``limit`` (user_id, username, total) rows ranked by total.
+
+        ``after`` is the (total, user_id) of the last row of the previous page;
+        pages are found by seeking the ranking index rather than with OFFSET.
+        """
+        source, where, params = _ranking_source(window, today, guild_id)
+        if after is not None:
+            where += " AND (t.total < ? OR (t.total = ? AND t.user_id > ?))"
+            params += [after[0], after[0], after[1]]
+        return await self.fetchall(
+            f"SELECT t.user_id, users.username, t.total FROM {source} "
+            f"JOIN users ON users.user_id = t.user_id WHERE {where} "
+            "ORDER BY t.total DESC, t.user_id LIMIT ?",
+            params + [limit]
+        )
+
+    async def leaderboard_rank(self, user_id: int, window: str, today: datetime.date, guild_id: int = None):
+        """Return (rank, total) for the user in ``window``, or None if they have no playtime in it."""
+        source, where, params = _ranking_source(window, today, guild_id)
+        row = await self.fetchone(
+            f"SELECT t.total FROM {source} WHERE {where} AND t.user_id = ?", params + [user_id]
+        )
+        if row is None:
+            return None
+        # Only the users ranked above are counted, via the same total-ordered index.
+        above = await self.fetchone(
+            f"SELECT COUNT(*) FROM {source} WHERE {where} AND t.total > ?", params + [row[0]]
+        )
+        return above[0] + 1, row[0]
+
+    async def iter_history(self, user_id: int = None, start: datetime.date = None, end: datetime.date = None,
+                           chunk_size: int = EXPORT_CHUNK_SIZE):
+        """Yield raw submissions as lists of (user_id, date, playtime) without loading them all."""
+        clauses, params = [], []
+        if user_id is not None:
+            clauses.append("user_id = ?")
+            params.append(user_id)
+        if start is not None:
+            clauses.append("day >= ?")
+            params.append(to_day(start))
+        if end is not None:
+            clauses.append("day <= ?")
+            params.append(to_day(end))
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        # A single user's rows come straight off the (user_id, day) index; for
+        # everyone, rowid order streams the table without a sort.
+        order = "day, id" if user_id is not None else "id"
+
+        async with self.reader() as conn:
+            async with conn.execute(
+                f"SELECT user_id, day, playtime FROM playtime {where} ORDER BY {order}", params
+            ) as cursor:
+                while rows := await cursor.fetchmany(chunk_size):
+                    yield [(row_user_id, from_day(day), playtime) for row_user_id, day, playtime in rows]
+
+    async def count_playtime(self) -> int:
+        return (await self.fetchone("SELECT COUNT(*) FROM playtime"))[0]
+
+    async def load_rows(self, table: str, columns, rows):
+        # SQLite triggers can't be switched off, so the rollups are maintained
+        # anyway; rebuild_aggregates afterwards still fixes up the streaks.
+        async with self.transaction() as db:
+            await db.executemany(
+                f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})", rows
+            )
+
+    async def rebuild_aggregates(self):
+        async with self.transaction() as db:
+            for statement in REBUILD_AGGREGATES:
+                await db.execute(statement)
+
+    # Settings
+
+    async def get_setting(self, key: str):
+        row = await self.fetchone("SELECT value FROM settings WHERE key = ?", (key,))
+        return row[0] if row else None
+
+    async def set_setting(self, key: str, value: str):
+        await self.execute(
+            "INSERT INTO settings (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, value)
+        )
+
+    # Goals
+
+    async def set_goal(self, user_id: int, goal: float):
+        async with self.transaction() as db:
+            await db.execute(
+                "INSERT INTO goals (user_id, goal) VALUES (?, ?) ON CONFLICT(user_id) DO UPDATE SET goal = ?",
+                (user_id, goal, goal)
+            )
+            await db.execute(
+                "INSERT OR IGNORE INTO goal_checks (user_id, day) "
+                "SELECT user_id, MAX(day) FROM daily_totals WHERE user_id = ? GROUP BY user_id",
+                (user_id,)
+            )
+
+    async def get_goal(self, user_id: int):
+        row = await self.fetchone("SELECT goal FROM goals WHERE user_id = ?", (user_id,))
+        return row[0] if row else None
+
+    async def claim_goal(self, user_id: int, total: float):
+        """Delete the user's goal if ``total`` meets it, returning the goal that was cleared."""
+        async with self.transaction() as db:
+            async with db.execute(
+                "DELETE FROM goals WHERE user_id = ? AND goal <= ? RETURNING goal", (user_id, total)
+            ) as cursor:
+                row = await cursor.fetchone()
+        return row[0] if row else None
+
+    async def claim_met_goals(self, shard_ids=None, shard_count: int = None):
+        # The whole sweep runs under BEGIN IMMEDIATE, which holds SQLite's
+        # write lock across processes, so a goal is handed out exactly once.
+        shard, params = "", []
+        if shard_ids is not None:
+            shard = f"WHERE goal_checks.user_id % ? IN ({', '.join('?' * len(shard_ids))})"
+            params = [shard_count, *shard_ids]
+        async with self.transaction() as db:
+            async with db.execute(
+                "SELECT goal_checks.user_id, goal_checks.day, users.timezone, goals.goal, daily_totals.total "
+                "FROM goal_checks "
+                "LEFT JOIN users ON users.user_id = goal_checks.user_id "
+                "LEFT JOIN goals ON goals.user_id = goal_checks.user_id "
+                "LEFT JOIN daily_totals ON daily_totals.user_id = goal_checks.user_id "
+                f"AND daily_totals.day = goal_checks.day {shard}",
+                params
+            ) as cursor:
+                met, done = due_goals(await cursor.fetchall())
+            # One statement per table however many rows go: the pairs travel as a single JSON array.
+            if done:
+                await db.execute(
+                    "DELETE FROM goal_checks WHERE (user_id, day) IN "
+                    "(SELECT json_extract(value, '$[0]'), json_extract(value, '$[1]') FROM json_each(?))",
+                    (json.dumps(done),)
+                )
+            if met:
+                await db.execute(
+                    "DELETE FROM goals WHERE user_id IN (SELECT value FROM json_each(?))",
+                    (json.dumps([user_id for user_id, _, _ in met]),)
+                )
+        return met
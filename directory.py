@@ -0,0 +1,116 @@
+import collections
+import datetime
+import os
+import time
+from metrics import metrics
+from storage import local_today
+
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 10_000))
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", 6 * 60 * 60))
+# With SHARD_IDS, other processes share the database and can change a user
+# (their timezone, say) without this one hearing of it, so entries expire sooner.
+SHARED_USER_CACHE_TTL = int(os.getenv("SHARED_USER_CACHE_TTL", 60))
+# Keeps each lookup's IN (...) list well under SQLite's bound parameter limit.
+LOOKUP_BATCH = 500
+
+DirectoryEntry = collections.namedtuple("DirectoryEntry", "username dm_channel_id timezone")
+
+
+class UserDirectory:
+    """Names, DM channels and timezones of everyone who has submitted playtime, without asking Discord.
+
+    An LRU with a TTL in front of the users table. The bot refreshes it from
+    gateway events and interactions as they arrive, so the table stays
+    current; the TTL only bounds how long a change written by another
+    process can go unseen here. Users the table doesn't have are cached as
+    missing too, so people who never submitted don't cost a query on every
+    interaction; call added after writing someone's first playtime.
+    """
+
+    def __init__(self, db, max_entries: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL):
+        self.db = db
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # user_id -> (DirectoryEntry, or None for users the table doesn't have, expiry time)
+        self._entries = collections.OrderedDict()
+
+    def _get(self, user_id: int):
+        """Return (cached, entry); entry is None for users cached as missing."""
+        cached = self._entries.get(user_id)
+        if cached is None:
+            return False, None
+        entry, expires = cached
+        if expires < time.monotonic():
+            del self._entries[user_id]
+            return False, None
+        self._entries.move_to_end(user_id)
+        return True, entry
+
+    def _put(self, user_id: int, entry):
+        self._entries[user_id] = (entry, time.monotonic() + self.ttl)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return entry
+
+    def added(self, user_id: int):
+        """Note that a write gave ``user_id`` a users row, in case they are cached as missing."""
+        cached = self._entries.get(user_id)
+        if cached is not None and cached[0] is None:
+            del self._entries[user_id]
+
+    async def lookup(self, user_ids) -> dict:
+        """Map each known user id to its DirectoryEntry; misses are loaded from the database in bulk."""
+        found, missing, hits = {}, [], 0
+        for user_id in dict.fromkeys(user_ids):
+            cached, entry = self._get(user_id)
+            if not cached:
+                missing.append(user_id)
+                continue
+            hits += 1
+            if entry is not None:
+                found[user_id] = entry
+        metrics.increment("playtime_user_cache_hits_total", hits)
+        metrics.increment("playtime_user_cache_misses_total", len(missing))
+
+        for i in range(0, len(missing), LOOKUP_BATCH):
+            batch = missing[i:i + LOOKUP_BATCH]
+            for user_id, *fields in await self.db.get_users(batch):
+                found[user_id] = self._put(user_id, DirectoryEntry(*fields))
+            for user_id in batch:
+                if user_id not in found:
+                    self._put(user_id, None)
+        return found
+
+    async def names(self, user_ids) -> dict:
+        return {user_id: entry.username for user_id, entry in (await self.lookup(user_ids)).items()}
+
+    async def dm_channel_id(self, user_id: int):
+        entry = (await self.lookup([user_id])).get(user_id)
+        return entry.dm_channel_id if entry is not None else None
+
+    async def timezone(self, user_id: int):
+        entry = (await self.lookup([user_id])).get(user_id)
+        return entry.timezone if entry is not None else None
+
+    async def today(self, user_id: int) -> datetime.date:
+        """The user's current date in their own timezone."""
+        return local_today(await self.timezone(user_id))
+
+    async def set_timezone(self, user, timezone: str):
+        entry = (await self.lookup([user.id])).get(user.id)
+        await self.db.set_timezone(user.id, user.name, timezone)
+        self._put(user.id, DirectoryEntry(user.name, entry.dm_channel_id if entry is not None else None, timezone))
+
+    async def remember_dm_channel(self, user_id: int, channel_id: int):
+        entry = (await self.lookup([user_id])).get(user_id)
+        if entry is not None and entry.dm_channel_id != channel_id:
+            await self.db.set_dm_channel(user_id, channel_id)
+            self._put(user_id, entry._replace(dm_channel_id=channel_id))
+
+    async def observe(self, user):
+        """Record ``user``'s current name if they're in the directory and it changed."""
+        entry = (await self.lookup([user.id])).get(user.id)
+        if entry is not None and entry.username != user.name:
+            await self.db.rename_user(user.id, user.name)
+            self._put(user.id, entry._replace(username=user.name))
@@ -1,31 +1,13 @@
 import asyncio
-import aiosqlite
 import datetime
 import random
-
-DATABASE = 'playtime.db'
+from storage import create_storage
 
 async def main():
-    async with aiosqlite.connect(DATABASE) as db:
-        # Create the playtime table if it doesn't exist
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS playtime (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                username TEXT,
-                playtime REAL,
-                date TEXT
-            )
-        ''')
-        # Create the goals table if it doesn't exist
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS goals (
-                user_id INTEGER PRIMARY KEY,
-                goal REAL
-            )
-        ''')
-        await db.commit()
-
+    # Opening the database creates or migrates the schema
+    db = create_storage()
+    await db.open()
+    try:
         # Define dummy users with their IDs and usernames
         users = [
             {"id": 1037849676801638430, "username": "t3mite"},
@@ -38,6 +20,7 @@ async def main():
         end_date = datetime.date.today()
 
         # Insert dummy data: for each user, the playtime increases cumulatively over the days.
+        rows = []
         for user in users:
             cumulative_playtime = 0.0
             current_date = start_date
@@ -45,19 +28,15 @@ async def main():
                 # Generate a random increment between 1.0 and 5.0 hours
                 increment = round(random.uniform(1.0, 5.0), 2)
                 cumulative_playtime += increment
-                date_str = current_date.strftime("%Y-%m-%d")
-                await db.execute(
-                    "INSERT INTO playtime (user_id, username, playtime, date) VALUES (?, ?, ?, ?)",
-                    (user["id"], user["username"], cumulative_playtime, date_str)
-                )
+                rows.append((user["id"], user["username"], current_date, cumulative_playtime))
                 current_date += datetime.timedelta(days=1)
             # Insert a dummy goal for the user: random goal between 30 and 50 hours
             dummy_goal = round(random.uniform(30.0, 50.0), 2)
-            await db.execute(
-                "INSERT OR REPLACE INTO goals (user_id, goal) VALUES (?, ?)",
-                (user["id"], dummy_goal)
-            )
-        await db.commit()
+            await db.set_goal(user["id"], dummy_goal)
+        # One transaction for every row instead of a commit per row
+        await db.add_playtime_bulk(rows)
+    finally:
+        await db.close()
 
     print("Dummy data and goals inserted successfully.")
 
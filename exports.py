@@ -0,0 +1,75 @@
+import asyncio
+import csv
+import gzip
+import io
+import tempfile
+
+EXPORT_FORMATS = ("csv", "csv.gz", "parquet")
+
+# Exports stay in memory up to this size and roll over to a temp file past it.
+SPOOL_LIMIT = 8 * 1024 * 1024
+
+# Arrow type of every column an export can have. Declared up front because a
+# chunk whose usernames are all unknown would otherwise make the column null.
+PARQUET_TYPES = {
+    "User ID": "int64",
+    "Username": "string",
+    "Date": "date32",
+    "Playtime (hours)": "float64",
+}
+
+
+class ExportUnavailable(Exception):
+    """Raised when the requested export format needs an optional package that isn't installed."""
+
+
+async def _write_csv(chunks, columns, raw) -> int:
+    text = io.TextIOWrapper(raw, encoding="utf-8", newline="")
+    writer = csv.writer(text)
+    writer.writerow(columns)
+    count = 0
+    async for rows in chunks:
+        # Formatting (and compressing) a chunk is CPU work, keep it off the event loop.
+        await asyncio.to_thread(writer.writerows, rows)
+        count += len(rows)
+    text.flush()
+    text.detach()
+    return count
+
+
+async def _write_parquet(chunks, columns, spool) -> int:
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ExportUnavailable("Parquet exports need the optional `pyarrow` package.") from None
+
+    schema = pyarrow.schema([(column, getattr(pyarrow, PARQUET_TYPES[column])()) for column in columns])
+    count = 0
+    with pyarrow.parquet.ParquetWriter(spool, schema) as writer:
+        async for rows in chunks:
+            table = pyarrow.Table.from_pydict(dict(zip(columns, zip(*rows))), schema=schema)
+            await asyncio.to_thread(writer.write_table, table)
+            count += len(rows)
+    return count
+
+
+async def export_rows(chunks, columns, fmt: str = "csv"):
+    """Stream chunks of rows into a spooled file in ``fmt``.
+
+    ``chunks`` is an async iterator of row lists, such as Database.iter_history.
+    Returns the file, rewound and ready to upload, and the number of rows written.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format {fmt!r}")
+
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_LIMIT)
+    if fmt == "parquet":
+        count = await _write_parquet(chunks, columns, spool)
+    elif fmt == "csv.gz":
+        with gzip.GzipFile(fileobj=spool, mode="wb") as compressed:
+            count = await _write_csv(chunks, columns, compressed)
+    else:
+        count = await _write_csv(chunks, columns, spool)
+    spool.seek(0)
+    return spool, count
@@ -1,46 +1,142 @@
+import time
+STARTUP_BEGAN = time.perf_counter()
+
 import discord
 from discord import app_commands
 from discord.ext import commands
-import aiosqlite
 import os
 import csv
-import matplotlib.pyplot as plt
 import io
 import datetime
-from matplotlib.dates import DateFormatter
+import asyncio
+import contextlib
+import hashlib
+import json
+import logging
+import zoneinfo
 from dotenv import load_dotenv
+from storage import DATABASE_URL, GRANULARITIES, LEADERBOARD_WINDOWS, Storage, create_storage
+from rendering import COMPARE_MODES, ROLLING_WINDOW, ChartRenderer, RendererBusy
+from cache import ImageCache, cache_key
+from directory import SHARED_USER_CACHE_TTL, USER_CACHE_TTL, UserDirectory
+from throttle import SingleFlight, rate_limited
+from exports import EXPORT_FORMATS, ExportUnavailable, export_rows
+from metrics import COUNT_BUCKETS, SqlStats, current_sql, metrics, monitor_event_loop, serve_metrics
 load_dotenv()
 
-intents = discord.Intents.all()
+log = logging.getLogger(__name__)
+
+startup_times = {"imports": time.perf_counter() - STARTUP_BEGAN}
+
+@contextlib.contextmanager
+def startup_phase(name: str):
+    began = time.perf_counter()
+    yield
+    startup_times[name] = time.perf_counter() - began
+
+async def sync_commands(bot: commands.Bot) -> bool:
+    """Sync the command tree only if it changed since the last sync."""
+    payload = json.dumps([command.to_dict(bot.tree) for command in bot.tree.get_commands()], sort_keys=True)
+    digest = hashlib.sha256(payload.encode()).hexdigest()
+    if await bot.db.get_setting("command_hash") == digest:
+        return False
+    await bot.tree.sync()
+    await bot.db.set_setting("command_hash", digest)
+    return True
+
+async def is_bot_owner(interaction: discord.Interaction) -> bool:
+    return await interaction.client.is_owner(interaction.user)
+
+# Everything the bot does arrives as an interaction, which needs no intents;
+# guilds keeps interaction.guild populated. No privileged intents, so no
+# member lists or presences are streamed or cached per shard.
+intents = discord.Intents.none()
+intents.guilds = True
 status = discord.Status.idle
 
-bot = commands.Bot(
+# Discord's recommended shard count is used unless SHARD_COUNT is set. To split
+# the shards over several processes, give each the same SHARD_COUNT and its own
+# comma-separated SHARD_IDS; they can share one database file.
+SHARD_COUNT = int(os.getenv("SHARD_COUNT")) if os.getenv("SHARD_COUNT") else None
+SHARD_IDS = [int(shard_id) for shard_id in os.getenv("SHARD_IDS").split(",")] if os.getenv("SHARD_IDS") else None
+
+# Set METRICS_PORT to serve Prometheus metrics on http://127.0.0.1:<port>/metrics
+METRICS_PORT = os.getenv("METRICS_PORT")
+
+async def defer(interaction: discord.Interaction, **kwargs):
+    """Defer the response and note when, so metrics can split defer and followup time."""
+    await interaction.response.defer(**kwargs)
+    interaction.extras["deferred"] = time.perf_counter()
+
+def record_command(interaction: discord.Interaction, failed: bool = False):
+    started = interaction.extras.get("started")
+    if started is None or interaction.command is None:
+        return
+    name = interaction.command.qualified_name
+    finished = time.perf_counter()
+    metrics.observe("playtime_command_seconds", finished - started, command=name)
+    deferred = interaction.extras.get("deferred")
+    if deferred is not None:
+        metrics.observe("playtime_command_defer_seconds", deferred - started, command=name)
+        metrics.observe("playtime_command_followup_seconds", finished - deferred, command=name)
+    sql = interaction.extras["sql"]
+    metrics.observe("playtime_command_sql_queries", sql.queries, buckets=COUNT_BUCKETS, command=name)
+    metrics.observe("playtime_command_sql_seconds", sql.seconds, command=name)
+    if failed:
+        metrics.increment("playtime_command_errors_total", command=name)
+
+class InstrumentedTree(app_commands.CommandTree):
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        interaction.extras["started"] = time.perf_counter()
+        interaction.extras["sql"] = stats = SqlStats()
+        # The command runs in this same task, so database calls it makes see this.
+        current_sql.set(stats)
+        queued = (discord.utils.utcnow() - interaction.created_at).total_seconds()
+        metrics.observe("playtime_command_queue_seconds", max(0.0, queued))
+        return True
+
+class PlaytimeBot(commands.AutoShardedBot):
+    def __init__(self, **kwargs):
+        super().__init__(tree_cls=InstrumentedTree, **kwargs)
+        self.db = create_storage(DATABASE_URL)
+        self.renderer = ChartRenderer()
+        self.chart_cache = ImageCache()
+        self.directory = UserDirectory(self.db, ttl=USER_CACHE_TTL if SHARD_IDS is None else SHARED_USER_CACHE_TTL)
+        self.single_flight = SingleFlight()
+        self.commands_synced = False
+        self.loop_monitor = None
+        self.metrics_server = None
+
+    async def setup_hook(self):
+        with startup_phase("render workers"):
+            self.renderer.start()
+        with startup_phase("database"):
+            await self.db.open()
+        with startup_phase("extensions"):
+            await self.load_extension("cogs.goal_checker")
+        with startup_phase("command sync"):
+            self.commands_synced = await sync_commands(self)
+        self.loop_monitor = asyncio.create_task(monitor_event_loop())
+        if METRICS_PORT:
+            self.metrics_server = await serve_metrics("127.0.0.1", int(METRICS_PORT))
+
+    async def close(self):
+        await super().close()
+        if self.loop_monitor is not None:
+            self.loop_monitor.cancel()
+        if self.metrics_server is not None:
+            await self.metrics_server.cleanup()
+        self.renderer.close()
+        await self.db.close()
+
+bot = PlaytimeBot(
     command_prefix="!",
     intents=intents,
     status=status,
+    shard_count=SHARD_COUNT,
+    shard_ids=SHARD_IDS,
 )
 
-DATABASE = "playtime.db"
-
-async def initialize_db():
-    async with aiosqlite.connect(DATABASE) as db:
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS playtime (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                username TEXT,
-                playtime REAL,
-                date TEXT
-            )
-        ''')
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS goals (
-                user_id INTEGER PRIMARY KEY,
-                goal REAL
-            )
-        ''')
-        await db.commit()
-
 @app_commands.command(name="help", description="Show a detailed help guide for the Playtime Tracking Bot")
 @app_commands.allowed_installs(guilds=True, users=True)
 @app_commands.allowed_contexts(guilds=True, dms=True, private_channels=True)
@@ -55,7 +151,9 @@ async def help_command(interaction: discord.Interaction):
         value=(
             "• `/submit`: Log your playtime for a specific date\n"
             "  - Specify hours played and optionally a date\n"
-            "  - Default is today's date if not specified"
+            "  - Default is today's date if not specified\n\n"
+            "• `/importdata`: Import many days at once from a CSV file\n"
+            "  - Days in the file replace what you already logged on them"
         ),
         inline=False
     )
@@ -65,7 +163,8 @@ async def help_command(interaction: discord.Interaction):
             "• `/setgoal`: Set your daily playtime goal\n"
             "  - Input your desired playtime in hours\n\n"
             "• `/remindme`: Check progress towards your daily goal\n"
-            "  - Shows remaining time or confirms goal completion"
+            "  - Shows remaining time or confirms goal completion\n\n"
+            "• `/timezone`: Set the timezone your days are counted in"
         ),
         inline=False
     )
@@ -79,9 +178,11 @@ async def help_command(interaction: discord.Interaction):
         value=(
             "• `/graph`: Generate a line chart of your playtime\n"
             "  - Optional: Specify a user to view their graph\n"
-            "  - Shows total playtime aggregated by date\n\n"
-            "• `/compare`: Compare playtime between two users\n"
-            "  - Visualize playtime trends side by side"
+            "  - Shows total playtime aggregated by date\n"
+            "  - Optional: A start/end date and day, week or month totals\n\n"
+            "• `/compare`: Compare playtime between up to 10 users\n"
+            "  - Visualize playtime trends side by side\n"
+            "  - Optional: Running totals or rolling averages"
         ),
         inline=False
     )
@@ -89,9 +190,11 @@ async def help_command(interaction: discord.Interaction):
         name="🏆 Leaderboard and Progress",
         value=(
             "• `/leaderboard`: View top players by total playtime\n"
-            "  - Default shows top 10 users\n"
-            "  - Customize number of users displayed\n\n"
-            "• `/streak`: Check your consecutive playtime tracking days"
+            "  - Today, this week, this month or all time\n"
+            "  - Optional: Only people in this server\n"
+            "  - Page through with the buttons and see your own rank\n\n"
+            "• `/streak`: Check your consecutive playtime tracking days\n"
+            "• `/streakleaderboard`: View the longest or current streaks"
         ),
         inline=False
     )
@@ -104,8 +207,9 @@ async def help_command(interaction: discord.Interaction):
         name="📁 Data Management",
         value=(
             "• `/exportdata`: Download your playtime records\n"
-            "  - Export as CSV file\n"
-            "  - Optional: Export data for another user"
+            "  - Export as CSV, gzipped CSV or Parquet\n"
+            "  - Optional: Export data for another user\n"
+            "  - Optional: Limit to a date range"
         ),
         inline=False
     )
@@ -140,18 +244,20 @@ async def help_command(interaction: discord.Interaction):
 
     await interaction.response.send_message(embed=help_embeds[0], view=view)
 
+TIMEZONES = sorted(zoneinfo.available_timezones())
+
+# Nobody plays more than a day's worth of hours in a day.
+MAX_DAILY_HOURS = 24
+
 @app_commands.command(name="setgoal", description="Set your daily playtime goal (in hours)")
 @app_commands.allowed_installs(guilds=True, users=True)
 @app_commands.allowed_contexts(guilds=True, dms=True, private_channels=True)
 @app_commands.describe(goal="Your playtime goal (as a float, in hours)")
-async def setgoal(interaction: discord.Interaction, goal: float):
-    await interaction.response.defer()
+async def setgoal(interaction: discord.Interaction, goal: app_commands.Range[float, 0, MAX_DAILY_HOURS]):
+    await defer(interaction)
     user_id = interaction.user.id
 
-    async with aiosqlite.connect(DATABASE) as db:
-        await db.execute("INSERT INTO goals (user_id, goal) VALUES (?, ?) ON CONFLICT(user_id) DO UPDATE SET goal = ?",
-                         (user_id, goal, goal))
-        await db.commit()
+    await interaction.client.db.set_goal(user_id, goal)
 
     await interaction.followup.send(f"🎯 Playtime goal set to **{goal} hours**!")
 
@@ -159,24 +265,18 @@ async def setgoal(interaction: discord.Interaction, goal: float):
 @app_commands.allowed_installs(guilds=True, users=True)
 @app_commands.allowed_contexts(guilds=True, dms=True, private_channels=True)
 async def remindme(interaction: discord.Interaction):
-    await interaction.response.defer()
+    await defer(interaction)
     user_id = interaction.user.id
-    date_today = datetime.date.today().strftime("%Y-%m-%d")
+    date_today = await interaction.client.directory.today(user_id)
 
-    async with aiosqlite.connect(DATABASE) as db:
-        cursor = await db.execute("SELECT goal FROM goals WHERE user_id = ?", (user_id,))
-        goal_row = await cursor.fetchone()
+    db = interaction.client.db
 
-    if not goal_row:
+    goal = await db.get_goal(user_id)
+    if goal is None:
         await interaction.followup.send("⚠️ You haven't set a playtime goal yet. Use `/setgoal` first!", )
         return
 
-    goal = goal_row[0]
-
-    async with aiosqlite.connect(DATABASE) as db:
-        cursor = await db.execute("SELECT SUM(playtime) FROM playtime WHERE user_id = ? AND date = ?", (user_id, date_today))
-        playtime_row = await cursor.fetchone()
-        total_playtime = playtime_row[0] if playtime_row[0] else 0
+    total_playtime = await db.daily_total(user_id, date_today)
 
     if total_playtime >= goal:
         await interaction.followup.send(f"✅ You've reached your playtime goal of **{goal} hours** today! Great job! 🎉")
@@ -184,44 +284,97 @@ async def remindme(interaction: discord.Interaction):
         remaining = goal - total_playtime
         await interaction.followup.send(f"⏳ You still need **{remaining:.2f} more hours** to reach your goal today. Keep going! 💪")
 
+@app_commands.command(name="timezone", description="Set the timezone your days and goals are counted in")
+@app_commands.allowed_installs(guilds=True, users=True)
+@app_commands.allowed_contexts(guilds=True, dms=True, private_channels=True)
+@app_commands.describe(timezone="IANA timezone name, e.g. Europe/London (leave empty to use the bot's)")
+async def timezone(interaction: discord.Interaction, timezone: str = None):
+    await defer(interaction, ephemeral=True)
+    if timezone is not None and timezone not in TIMEZONES:
+        await interaction.followup.send(f"⚠️ Unknown timezone `{timezone}`. Pick one from the suggestions, like `Europe/London`.")
+        return
+
+    await interaction.client.directory.set_timezone(interaction.user, timezone)
+    today = await interaction.client.directory.today(interaction.user.id)
+    await interaction.followup.send(
+        f"🕒 Timezone set to **{timezone or 'the bot default'}**. Today is {today:%A %d %B} for you. "
+        "Earlier submissions keep the days they were logged on."
+    )
+
+@timezone.autocomplete("timezone")
+async def timezone_autocomplete(interaction: discord.Interaction, current: str):
+    current = current.lower()
+    matches = [name for name in TIMEZONES if current in name.lower()]
+    return [app_commands.Choice(name=name, value=name) for name in matches[:25]]
+
 @app_commands.command(name="streak", description="Check your current playtime streak")
 @app_commands.allowed_installs(guilds=True, users=True)
 @app_commands.allowed_contexts(guilds=True, dms=True, private_channels=True)
 async def streak(interaction: discord.Interaction):
-    await interaction.response.defer()
+    await defer(interaction)
     user_id = interaction.user.id
 
-    async with aiosqlite.connect(DATABASE) as db:
-        cursor = await db.execute("SELECT DISTINCT date FROM playtime WHERE user_id = ? ORDER BY date DESC", (user_id,))
-        rows = await cursor.fetchall()
+    row = await interaction.client.db.get_streak(user_id)
 
-    if not rows:
+    if not row:
         await interaction.followup.send("You haven't submitted any playtime yet.", )
         return
 
-    dates = [datetime.datetime.strptime(row[0], "%Y-%m-%d") for row in rows]
+    streak_count, longest = row
 
-    streak_count = 1
-    for i in range(len(dates) - 1):
-        if (dates[i] - dates[i + 1]).days == 1:
-            streak_count += 1
-        else:
-            break   
+    await interaction.followup.send(
+        f"🔥 {interaction.user.name}, your current playtime streak is **{streak_count} days**! "
+        f"Your longest ever is **{longest} days**."
+    )
 
-    await interaction.followup.send(f"🔥 {interaction.user.name}, your current playtime streak is **{streak_count} days**!")
+STREAK_LEADERBOARD_LIMIT = 25
+
+@app_commands.command(name="streakleaderboard", description="Show the users with the longest playtime streaks")
+@app_commands.allowed_installs(guilds=True, users=True)
+@app_commands.allowed_contexts(guilds=True, dms=True, private_channels=True)
+@app_commands.describe(
+    kind="Rank by longest streak ever or by streaks still running (default: longest)",
+    limit=f"Number of users to display (default: 10, max: {STREAK_LEADERBOARD_LIMIT})",
+)
+@app_commands.choices(kind=[
+    app_commands.Choice(name="longest", value="longest"),
+    app_commands.Choice(name="current", value="current"),
+])
+async def streakleaderboard(interaction: discord.Interaction, kind: str = "longest",
+                            limit: app_commands.Range[int, 1, STREAK_LEADERBOARD_LIMIT] = 10):
+    await defer(interaction)
+    active_since = None
+    if kind == "current":
+        # A streak is still running if its last day is today or yesterday, in the caller's own days.
+        today = await interaction.client.directory.today(interaction.user.id)
+        active_since = today - datetime.timedelta(days=1)
+    rows = await interaction.client.db.streak_leaderboard(limit, active_since)
+
+    if not rows:
+        await interaction.followup.send("No streaks to show yet.", )
+        return
+
+    leaderboard_message = f"**🔥 {kind.capitalize()} Streak Leaderboard 🔥**\n"
+    for i, (username, days) in enumerate(rows, start=1):
+        leaderboard_message += f"**{i}. {username}** - {days} days\n"
+
+    await interaction.followup.send(leaderboard_message)
 
 
 @app_commands.command(name="submit", description="Submit your playtime for a given date")
+@rate_limited("submit")
 @app_commands.allowed_installs(guilds=True, users=True)
 @app_commands.allowed_contexts(guilds=True, dms=True, private_channels=True)
 @app_commands.describe(playtime="Playtime (in hours)", date="Date in format YYYY-MM-DD")
-async def submit(interaction: discord.Interaction, playtime: float, date: str = None):
-    await interaction.response.defer()
+async def submit(interaction: discord.Interaction, playtime: app_commands.Range[float, 0, MAX_DAILY_HOURS],
+                 date: str = None):
+    await defer(interaction)
     if date is None:
-        date = datetime.date.today().strftime("%Y-%m-%d")
+        # The submitter's own calendar day is stored, so totals never need converting later.
+        date = await interaction.client.directory.today(interaction.user.id)
     else:
         try:
-            datetime.datetime.strptime(date, "%Y-%m-%d")
+            date = datetime.datetime.strptime(date, "%Y-%m-%d").date()
         except ValueError:
             await interaction.followup.send("Date must be in format YYYY-MM-DD", )
             return
@@ -229,178 +382,449 @@ async def submit(interaction: discord.Interaction, playtime: float, date: str =
     user_id = interaction.user.id
     username = interaction.user.name
 
-    async with aiosqlite.connect(DATABASE) as db:
-        await db.execute("INSERT INTO playtime (user_id, username, playtime, date) VALUES (?, ?, ?, ?)",
-                         (user_id, username, playtime, date))
-        await db.commit()
+    daily_total = await interaction.client.db.add_playtime(user_id, username, playtime, date, interaction.guild_id)
+    interaction.client.directory.added(user_id)
+    interaction.client.dispatch("playtime_submitted", user_id, date, daily_total)
 
     await interaction.followup.send(f"Playtime of {playtime} submitted for {username} on {date}.")
 
-@app_commands.command(name="graph", description="Generate a line chart of total playtime aggregated by date")
+IMPORT_MAX_BYTES = 1024 * 1024
+
+@app_commands.command(name="importdata", description="Import your playtime history from a CSV file")
+@rate_limited("importdata")
 @app_commands.allowed_installs(guilds=True, users=True)
 @app_commands.allowed_contexts(guilds=True, dms=True, private_channels=True)
-@app_commands.describe(
-    user="User to show playtime for (defaults to yourself). If omitted entirely, shows ALL users combined."
-)
-async def graph(interaction: discord.Interaction, user: discord.User = None):
-    await interaction.response.defer()
-    async with aiosqlite.connect(DATABASE) as db:
-        if isinstance(user, discord.User):
-            cursor = await db.execute(
-                """SELECT date, SUM(playtime)
-                       FROM playtime
-                       WHERE user_id = ?
-                       GROUP BY date
-                       ORDER BY date""", (user.id,)
-            )
-        else:
-            cursor = await db.execute(
-                """SELECT date, SUM(playtime)
-                       FROM playtime
-                       GROUP BY date
-                       ORDER BY date"""
-            )
-        rows = await cursor.fetchall()
+@app_commands.describe(file="CSV with a date (YYYY-MM-DD) and hours per row, like the one /exportdata makes")
+async def importdata(interaction: discord.Interaction, file: discord.Attachment):
+    await defer(interaction)
+    if file.size > IMPORT_MAX_BYTES:
+        await interaction.followup.send(f"That file is too large, the limit is {IMPORT_MAX_BYTES // 1024} KB.", )
+        return
+
+    try:
+        text = (await file.read()).decode("utf-8-sig")
+    except UnicodeDecodeError:
+        await interaction.followup.send("That file isn't a UTF-8 CSV file.", )
+        return
+
+    user_id = interaction.user.id
+    username = interaction.user.name
+    rows = []
+    for line_number, record in enumerate(csv.reader(io.StringIO(text)), start=1):
+        if not record or (line_number == 1 and record[0].strip().lower() == "date"):
+            continue
+        try:
+            date = datetime.datetime.strptime(record[0].strip(), "%Y-%m-%d").date()
+            playtime = float(record[1])
+        except (ValueError, IndexError):
+            await interaction.followup.send(f"Line {line_number} should look like `YYYY-MM-DD,hours`.", )
+            return
+        if not 0 <= playtime <= MAX_DAILY_HOURS:
+            await interaction.followup.send(f"Line {line_number} has {playtime} hours; each entry must be 0-{MAX_DAILY_HOURS}.", )
+            return
+        rows.append((user_id, username, date, playtime))
 
     if not rows:
-        await interaction.followup.send(
-            "No playtime data available.", 
-        )
+        await interaction.followup.send("That file doesn't contain any playtime.", )
+        return
+
+    db = interaction.client.db
+    try:
+        inserted, replaced = await db.add_playtime_bulk(rows, interaction.guild_id)
+    except ValueError as e:
+        await interaction.followup.send(f"Nothing was imported. {e}", )
         return
+    interaction.client.directory.added(user_id)
 
-    dates = [datetime.datetime.strptime(row[0], "%Y-%m-%d") for row in rows]
-    total_playtimes = [row[1] for row in rows]
+    today = await interaction.client.directory.today(user_id)
+    if any(row[2] == today for row in rows):
+        interaction.client.dispatch("playtime_submitted", user_id, today, await db.daily_total(user_id, today))
 
-    plt.figure(figsize=(10, 5))
-    plt.plot(dates, total_playtimes, marker='o', linestyle='-',
-             color='blue', label=f"{user.name if isinstance(user, discord.User) else 'All Users'}")
-    plt.xlabel("Date")
-    plt.ylabel("Total Playtime (hours)")
-    plt.title("Total Playtime by Date")
-    plt.grid(True)
-    plt.legend()
-    plt.tight_layout()
+    await interaction.followup.send(
+        f"📥 Imported **{inserted}** entries for {username}, replacing {replaced} already stored on those days."
+    )
 
-    ax = plt.gca()
-    ax.xaxis.set_major_formatter(DateFormatter('%d %b, %Y'))
+def parse_date(text: str):
+    """Parse an optional YYYY-MM-DD argument; raises ValueError if it's malformed."""
+    return datetime.datetime.strptime(text, "%Y-%m-%d").date() if text else None
 
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png')
-    buf.seek(0)
-    plt.close()
 
-    file = discord.File(fp=buf, filename="graph.png")
-    await interaction.followup.send(file=file)
+GRANULARITY_CHOICES = [app_commands.Choice(name=name.title(), value=name) for name in GRANULARITIES]
 
-@app_commands.command(name="compare", description="Compare playtime between two users over time")
+@app_commands.command(name="graph", description="Generate a line chart of total playtime aggregated by date")
+@rate_limited("graph")
 @app_commands.allowed_installs(guilds=True, users=True)
 @app_commands.allowed_contexts(guilds=True, dms=True, private_channels=True)
-@app_commands.describe(user1="First user to compare", user2="Second user to compare")
-async def compare(interaction: discord.Interaction, user1: discord.User, user2: discord.User):
-    await interaction.response.defer()
-    async with aiosqlite.connect(DATABASE) as db:
-        cursor = await db.execute("SELECT date, SUM(playtime) FROM playtime WHERE user_id = ? GROUP BY date", (user1.id,))
-        rows1 = await cursor.fetchall()
-
-    async with aiosqlite.connect(DATABASE) as db:
-        cursor = await db.execute("SELECT date, SUM(playtime) FROM playtime WHERE user_id = ? GROUP BY date", (user2.id,))
-        rows2 = await cursor.fetchall()
-
-    if not rows1 and not rows2:
-        await interaction.response.send_message("No playtime data available for either user.", )
+@app_commands.describe(
+    user="User to show playtime for (defaults to yourself). If omitted entirely, shows ALL users combined.",
+    start="Only include dates on or after this one (YYYY-MM-DD)",
+    end="Only include dates on or before this one (YYYY-MM-DD)",
+    granularity="Sum playtime per day, week or month (default: day)",
+)
+@app_commands.choices(granularity=GRANULARITY_CHOICES)
+async def graph(interaction: discord.Interaction, user: discord.User = None, start: str = None,
+                end: str = None, granularity: str = "day"):
+    await defer(interaction)
+    try:
+        start_date, end_date = parse_date(start), parse_date(end)
+    except ValueError:
+        await interaction.followup.send("Dates must be in format YYYY-MM-DD", )
         return
 
-    data1 = {row[0]: row[1] for row in rows1}
-    data2 = {row[0]: row[1] for row in rows2}
+    db = interaction.client.db
+    user_id = user.id if isinstance(user, discord.User) else None
+    label = user.name if isinstance(user, discord.User) else 'All Users'
+
+    async def draw():
+        rows = await db.totals_by_period(user_id, start_date, end_date, granularity)
+        if not rows:
+            return None
+
+        days, total_playtimes = zip(*rows)
 
-    all_dates_str = sorted(set(data1.keys()).union(set(data2.keys())))
-    all_dates = [datetime.datetime.strptime(date_str, "%Y-%m-%d") for date_str in all_dates_str]
+        png = await interaction.client.renderer.line_chart(
+            [(label, days, total_playtimes, 'blue')],
+            title=f"Total Playtime by {granularity.title()}",
+            ylabel="Total Playtime (hours)",
+        )
+        interaction.client.chart_cache.put(key, png)
+        return png
+
+    version = await db.data_version(None if user_id is None else [user_id])
+    key = cache_key("graph", user_id, label, start_date, end_date, granularity, version)
+    png = interaction.client.chart_cache.get(key)
+    if png is None:
+        # Identical requests arriving together share one query and render.
+        png = await interaction.client.single_flight.run(key, draw)
+    if png is None:
+        await interaction.followup.send(
+            "No playtime data available.", 
+        )
+        return
 
-    playtimes1 = [data1.get(date_str, 0) for date_str in all_dates_str]
-    playtimes2 = [data2.get(date_str, 0) for date_str in all_dates_str]
+    file = discord.File(fp=io.BytesIO(png), filename="graph.png")
+    await interaction.followup.send(file=file)
 
-    plt.figure(figsize=(10, 5))
-    plt.plot(all_dates, playtimes1, marker='o', linestyle='-', label=user1.name)
-    plt.plot(all_dates, playtimes2, marker='o', linestyle='-', label=user2.name)
-    plt.xlabel("Date")
-    plt.ylabel("Total Playtime")
-    plt.title("Playtime Comparison Over Time")
-    plt.legend()
-    plt.grid(True)
-    plt.tight_layout()
+COMPARE_MAX_USERS = 10
+COMPARE_YLABELS = {
+    "daily": "Total Playtime (hours)",
+    "cumulative": "Cumulative Playtime (hours)",
+    "rolling": f"{ROLLING_WINDOW}-{{}} Average (hours)",
+}
 
-    ax = plt.gca()
-    ax.xaxis.set_major_formatter(DateFormatter('%d %b, %Y'))
+@app_commands.command(name="compare", description="Compare playtime between up to 10 users over time")
+@rate_limited("compare")
+@app_commands.allowed_installs(guilds=True, users=True)
+@app_commands.allowed_contexts(guilds=True, dms=True, private_channels=True)
+@app_commands.describe(
+    user1="First user to compare",
+    user2="Second user to compare",
+    **{f"user{i}": "Another user to compare (optional)" for i in range(3, COMPARE_MAX_USERS + 1)},
+    start="Only include dates on or after this one (YYYY-MM-DD)",
+    end="Only include dates on or before this one (YYYY-MM-DD)",
+    granularity="Sum playtime per day, week or month (default: day)",
+    mode="Plot each period's total, the running total or a rolling average (default: daily)",
+)
+@app_commands.choices(
+    granularity=GRANULARITY_CHOICES,
+    mode=[app_commands.Choice(name=mode.title(), value=mode) for mode in COMPARE_MODES],
+)
+async def compare(interaction: discord.Interaction, user1: discord.User, user2: discord.User,
+                  user3: discord.User = None, user4: discord.User = None, user5: discord.User = None,
+                  user6: discord.User = None, user7: discord.User = None, user8: discord.User = None,
+                  user9: discord.User = None, user10: discord.User = None, start: str = None, end: str = None,
+                  granularity: str = "day", mode: str = "daily"):
+    await defer(interaction)
+    try:
+        start_date, end_date = parse_date(start), parse_date(end)
+    except ValueError:
+        await interaction.followup.send("Dates must be in format YYYY-MM-DD", )
+        return
 
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png')
-    buf.seek(0)
-    plt.close()
+    db = interaction.client.db
+    users = {}
+    for user in (user1, user2, user3, user4, user5, user6, user7, user8, user9, user10):
+        if user is not None:
+            users.setdefault(user.id, user)
+    users = list(users.values())[:COMPARE_MAX_USERS]
+
+    async def draw():
+        user_ids = [user.id for user in users]
+        rows = await db.totals_by_period_for(user_ids, start_date, end_date, granularity)
+        if not rows:
+            return None
+
+        png = await interaction.client.renderer.comparison_chart(
+            [user.name for user in users], user_ids, rows, granularity, mode,
+            title="Playtime Comparison Over Time",
+            ylabel=COMPARE_YLABELS[mode].format(granularity),
+        )
+        interaction.client.chart_cache.put(key, png)
+        return png
+
+    key = cache_key(
+        "compare",
+        tuple((user.id, user.name) for user in users),
+        await db.data_version([user.id for user in users]),
+        start_date, end_date, granularity, mode,
+    )
+    png = interaction.client.chart_cache.get(key)
+    if png is None:
+        png = await interaction.client.single_flight.run(key, draw)
+    if png is None:
+        await interaction.followup.send("No playtime data available for any of these users.", )
+        return
 
-    file = discord.File(fp=buf, filename="compare.png")
+    file = discord.File(fp=io.BytesIO(png), filename="compare.png")
     await interaction.followup.send(file=file)
 
+LEADERBOARD_PAGE_LIMIT = 25
+LEADERBOARD_TITLES = {"today": "Today", "week": "This Week", "month": "This Month", "all": "All Time"}
+
+class LeaderboardView(discord.ui.View):
+    """Pages through a leaderboard with keyset cursors instead of offsets."""
+
+    def __init__(self, db: Storage, single_flight: SingleFlight, window: str, today: datetime.date, guild_id: int,
+                 page_size: int, footer: str):
+        super().__init__()
+        self.db = db
+        self.single_flight = single_flight
+        self.window = window
+        self.today = today
+        self.guild_id = guild_id
+        self.page_size = page_size
+        self.footer = footer
+        # The (total, user_id) each page starts after; the first page starts at the top.
+        self.cursors = [None]
+        self.rows = []
+
+    async def load(self):
+        # One extra row tells us whether there is a next page. Everyone opening
+        # the same page at once shares a single query.
+        args = (self.window, self.today, self.page_size + 1, self.guild_id, self.cursors[-1])
+        rows = await self.single_flight.run(("leaderboard", *args), lambda: self.db.leaderboard(*args))
+        self.rows = rows[:self.page_size]
+        self.previous_button.disabled = len(self.cursors) == 1
+        self.next_button.disabled = len(rows) <= self.page_size
+
+    def render(self) -> str:
+        scope = "Server" if self.guild_id is not None else "Global"
+        message = f"**🏆 {scope} Playtime Leaderboard - {LEADERBOARD_TITLES[self.window]} 🏆**\n"
+        first = (len(self.cursors) - 1) * self.page_size + 1
+        for i, (_, username, total_playtime) in enumerate(self.rows, start=first):
+            message += f"**{i}. {username}** - {total_playtime:.2f} hours\n"
+        return message + self.footer
+
+    @discord.ui.button(label="◀️ Previous", style=discord.ButtonStyle.secondary)
+    async def previous_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.cursors.pop()
+        await self.load()
+        await interaction.response.edit_message(content=self.render(), view=self)
+
+    @discord.ui.button(label="Next ▶️", style=discord.ButtonStyle.secondary)
+    async def next_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        user_id, _, total_playtime = self.rows[-1]
+        self.cursors.append((total_playtime, user_id))
+        await self.load()
+        await interaction.response.edit_message(content=self.render(), view=self)
+
 @app_commands.command(name="leaderboard", description="Show the top users with the most playtime")
+@rate_limited("leaderboard")
 @app_commands.allowed_installs(guilds=True, users=True)
 @app_commands.allowed_contexts(guilds=True, dms=True, private_channels=True)
-@app_commands.describe(limit="Number of users to display (default: 10)")
-async def leaderboard(interaction: discord.Interaction, limit: int = 10):
-    await interaction.response.defer()
-    async with aiosqlite.connect(DATABASE) as db:
-        cursor = await db.execute("SELECT username, SUM(playtime) FROM playtime GROUP BY user_id ORDER BY SUM(playtime) DESC LIMIT ?", (limit,))
-        rows = await cursor.fetchall()
+@app_commands.describe(
+    window="Time window to rank (default: all)",
+    server="Only rank people who submitted playtime in this server",
+    limit=f"Number of users per page (default: 10, max: {LEADERBOARD_PAGE_LIMIT})",
+)
+@app_commands.choices(window=[app_commands.Choice(name=window, value=window) for window in LEADERBOARD_WINDOWS])
+async def leaderboard(interaction: discord.Interaction, window: str = "all", server: bool = False,
+                      limit: app_commands.Range[int, 1, LEADERBOARD_PAGE_LIMIT] = 10):
+    await defer(interaction)
+    db = interaction.client.db
+    today = await interaction.client.directory.today(interaction.user.id)
+    guild_id = interaction.guild_id if server else None
+
+    rank = await db.leaderboard_rank(interaction.user.id, window, today, guild_id)
+    if rank:
+        footer = f"\nYou are **#{rank[0]}** with {rank[1]:.2f} hours."
+    else:
+        footer = "\nYou're not on this leaderboard yet."
 
-    if not rows:
+    view = LeaderboardView(db, interaction.client.single_flight, window, today, guild_id, limit, footer)
+    await view.load()
+
+    if not view.rows:
         await interaction.followup.send("No playtime data available.", )
         return
 
-    leaderboard_message = "**🏆 Playtime Leaderboard 🏆**\n"
-    for i, (username, total_playtime) in enumerate(rows, start=1):
-        leaderboard_message += f"**{i}. {username}** - {total_playtime:.2f} hours\n"
+    await interaction.followup.send(view.render(), view=view)
 
-    await interaction.followup.send(leaderboard_message)
 
+async def with_usernames(chunks, directory: UserDirectory):
+    """Add each row's username after its user id, resolved in bulk through the directory."""
+    async for rows in chunks:
+        names = await directory.names(row[0] for row in rows)
+        yield [(user_id, names.get(user_id), *rest) for user_id, *rest in rows]
 
-@app_commands.command(name="exportdata", description="Download your playtime data as a CSV file")
+@app_commands.command(name="exportdata", description="Download your playtime data as a CSV or Parquet file")
+@rate_limited("exportdata")
 @app_commands.allowed_installs(guilds=True, users=True)
 @app_commands.allowed_contexts(guilds=True, dms=True, private_channels=True)
-@app_commands.describe(user="User to export data for (default: yourself)")
-async def exportdata(interaction: discord.Interaction, user: discord.User = None):
-    await interaction.response.defer()
-    user_id = interaction.user.id
-    if user:
-        user_id = user.id
-    async with aiosqlite.connect(DATABASE) as db:
-        async with db.execute("SELECT date, playtime FROM playtime WHERE user_id = ? ORDER BY date", (user_id,)) as cursor:
-            rows = await cursor.fetchall()
-    
-    if not rows:
+@app_commands.describe(
+    user="User to export data for (default: yourself)",
+    start="Only include dates on or after this one (YYYY-MM-DD)",
+    end="Only include dates on or before this one (YYYY-MM-DD)",
+    format="File format (default: csv)",
+    everyone="Export every user's data (bot owner only)",
+)
+@app_commands.choices(format=[app_commands.Choice(name=fmt, value=fmt) for fmt in EXPORT_FORMATS])
+async def exportdata(interaction: discord.Interaction, user: discord.User = None, start: str = None,
+                     end: str = None, format: str = "csv", everyone: bool = False):
+    await defer(interaction)
+    try:
+        start_date, end_date = parse_date(start), parse_date(end)
+    except ValueError:
+        await interaction.followup.send("Dates must be in format YYYY-MM-DD", )
+        return
+
+    db = interaction.client.db
+    if everyone:
+        if not await is_bot_owner(interaction):
+            await interaction.followup.send("⛔ Only the bot owner can export everyone's data.", )
+            return
+        user_id = None
+        filename = f"playtime_all.{format}"
+    else:
+        user_id = interaction.user.id
+        if user:
+            user_id = user.id
+        filename = f"playtime_{user_id}.{format}"
+    limit = interaction.guild.filesize_limit if interaction.guild else discord.utils.DEFAULT_FILE_SIZE_LIMIT_BYTES
+
+    async def build():
+        """The export's bytes, b"" if it has no rows, or None if it's over ``limit``."""
+        if user_id is None:
+            chunks = with_usernames(db.iter_history(start=start_date, end=end_date), interaction.client.directory)
+            columns = ["User ID", "Username", "Date", "Playtime (hours)"]
+        else:
+            history = db.iter_history(user_id, start_date, end_date)
+            chunks = ([row[1:] for row in rows] async for rows in history)
+            columns = ["Date", "Playtime (hours)"]
+        file, count = await export_rows(chunks, columns, format)
+        with file:
+            if not count:
+                return b""
+            if file.seek(0, io.SEEK_END) > limit:
+                return None
+            file.seek(0)
+            return file.read()
+
+    # Identical exports requested together are written once and uploaded to each.
+    version = await db.data_version(None if user_id is None else [user_id])
+    key = ("export", user_id, start_date, end_date, format, limit, version)
+    try:
+        data = await interaction.client.single_flight.run(key, build)
+    except ExportUnavailable as e:
+        await interaction.followup.send(f"⚠️ {e}", )
+        return
+
+    if data is None:
+        await interaction.followup.send("📦 That export is too large to upload. Try a narrower date range or `csv.gz`.", )
+        return
+    if not data:
         await interaction.followup.send("No playtime data available to export.", )
         return
-    
-    filename = f"playtime_{user_id}.csv"
-    with open(filename, mode='w', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerow(["Date", "Playtime (hours)"])
-        writer.writerows(rows)
-    
-    await interaction.followup.send(file=discord.File(filename))
-    os.remove(filename)
+
+    await interaction.followup.send(file=discord.File(io.BytesIO(data), filename=filename))
+
+@app_commands.command(name="rebuildstats", description="Regenerate playtime totals from the raw submissions (bot owner only)")
+@app_commands.allowed_installs(guilds=True, users=True)
+@app_commands.allowed_contexts(guilds=True, dms=True, private_channels=True)
+@app_commands.check(is_bot_owner)
+async def rebuildstats(interaction: discord.Interaction):
+    await defer(interaction, ephemeral=True)
+    await interaction.client.db.rebuild_aggregates()
+    await interaction.followup.send("📊 Playtime totals have been rebuilt.")
+
+@app_commands.command(name="stats", description="Show command latency and database metrics (bot owner only)")
+@app_commands.allowed_installs(guilds=True, users=True)
+@app_commands.allowed_contexts(guilds=True, dms=True, private_channels=True)
+@app_commands.check(is_bot_owner)
+async def stats(interaction: discord.Interaction):
+    await defer(interaction, ephemeral=True)
+    histograms = metrics.histograms
+    lines = [f"{'command':<18}{'calls':>7}{'p50':>8}{'p99':>8}{'sql/call':>9}"]
+    for (name, labels), histogram in sorted(histograms.items()):
+        if name != "playtime_command_seconds":
+            continue
+        queries = histograms[("playtime_command_sql_queries", labels)]
+        lines.append(
+            f"{dict(labels)['command']:<18}{histogram.count:>7}{histogram.quantile(0.5):>7}s"
+            f"{histogram.quantile(0.99):>7}s{queries.sum / queries.count:>9.1f}"
+        )
+    for name, label in (
+        ("playtime_event_loop_lag_seconds", "event loop lag"),
+        ("playtime_render_seconds", "chart render"),
+        ("playtime_goal_sweep_seconds", "goal sweep"),
+    ):
+        for (series_name, labels), histogram in sorted(histograms.items()):
+            if series_name == name and histogram.count:
+                lines.append(f"{label:<18}{histogram.count:>7}{histogram.quantile(0.5):>7}s{histogram.quantile(0.99):>7}s")
+    await interaction.followup.send("```\n" + "\n".join(lines) + "\n```")
+
+@bot.event
+async def on_app_command_completion(interaction: discord.Interaction, command):
+    record_command(interaction)
+
+@bot.tree.error
+async def on_app_command_error(interaction: discord.Interaction, error: app_commands.AppCommandError):
+    record_command(interaction, failed=True)
+    # CommandOnCooldown is a CheckFailure, so it has to be matched first.
+    if isinstance(error, app_commands.CommandOnCooldown):
+        metrics.increment("playtime_rate_limited_total", command=interaction.command.qualified_name)
+        message = f"⏳ Slow down! You can use this command again in {error.retry_after:.0f}s."
+    elif isinstance(error, app_commands.CheckFailure):
+        message = "⛔ You can't use this command."
+    elif isinstance(getattr(error, "original", None), RendererBusy):
+        message = "⏳ Too many charts are being drawn right now. Please try again in a moment."
+    else:
+        log.error("Command %s failed", interaction.command.name if interaction.command else "?", exc_info=error)
+        message = "Something went wrong while running this command."
+    if interaction.response.is_done():
+        await interaction.followup.send(message, ephemeral=True)
+    else:
+        await interaction.response.send_message(message, ephemeral=True)
+
+bot.tree.add_command(submit)
+bot.tree.add_command(importdata)
+bot.tree.add_command(graph)
+bot.tree.add_command(compare)
+bot.tree.add_command(exportdata)
+bot.tree.add_command(leaderboard)
+bot.tree.add_command(streak)
+bot.tree.add_command(streakleaderboard)
+bot.tree.add_command(setgoal)
+bot.tree.add_command(remindme)
+bot.tree.add_command(timezone)
+bot.tree.add_command(help_command)
+bot.tree.add_command(rebuildstats)
+bot.tree.add_command(stats)
+
+@bot.listen()
+async def on_interaction(interaction: discord.Interaction):
+    # Every interaction carries the user's current name, which keeps the directory fresh for free.
+    await bot.directory.observe(interaction.user)
 
 @bot.event
 async def on_ready():
     await bot.change_presence(activity=discord.CustomActivity(name='go outside.'))
-    await initialize_db()
-    bot.tree.add_command(submit)
-    bot.tree.add_command(graph)
-    bot.tree.add_command(compare)
-    bot.tree.add_command(exportdata)
-    bot.tree.add_command(streak)
-    bot.tree.add_command(setgoal)
-    bot.tree.add_command(remindme)
-    bot.tree.add_command(help_command)
-    await bot.tree.sync()
-    await bot.load_extension("cogs.goal_checker")
-    print(f"Logged in as {bot.user} and slash commands have been synced.")
-
-bot.run(os.getenv("token"))
+    if "ready" not in startup_times:
+        startup_times["ready"] = time.perf_counter() - STARTUP_BEGAN
+        report = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in startup_times.items())
+        print(f"Startup: {report}")
+    synced = "have been synced" if bot.commands_synced else "were already up to date"
+    print(f"Logged in as {bot.user} and slash commands {synced}.")
+
+if __name__ == "__main__":
+    bot.run(os.getenv("token"))
@@ -0,0 +1,140 @@
+import asyncio
+import bisect
+import collections
+import contextlib
+import contextvars
+import time
+
+# Upper bounds in seconds, Prometheus-style; the last implicit bucket is +Inf.
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Estimate the q-quantile as the upper bound of the bucket it falls in."""
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float("inf")
+
+
+class SqlStats:
+    """Database round trips made on behalf of one interaction."""
+
+    __slots__ = ("queries", "seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+
+# Set for the duration of an app command so the database can attribute its work to it.
+current_sql = contextvars.ContextVar("current_sql", default=None)
+
+
+def _format_labels(labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+class Metrics:
+    """In-process registry of counters, gauges and histograms."""
+
+    def __init__(self):
+        self.counters = collections.defaultdict(float)
+        self.gauges = {}
+        self.histograms = {}
+
+    def increment(self, name: str, value: float = 1, **labels):
+        self.counters[name, tuple(sorted(labels.items()))] += value
+
+    def set_gauge(self, name: str, value: float, **labels):
+        self.gauges[name, tuple(sorted(labels.items()))] = value
+
+    def observe(self, name: str, value: float, buckets=LATENCY_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram(buckets)
+        histogram.observe(value)
+
+    @contextlib.contextmanager
+    def timer(self, name: str, **labels):
+        began = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - began, **labels)
+
+    def record_query(self, seconds: float):
+        self.increment("playtime_sql_queries_total")
+        self.increment("playtime_sql_seconds_total", seconds)
+        stats = current_sql.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.seconds += seconds
+
+    def render(self) -> str:
+        """Render every metric in the Prometheus text exposition format."""
+        lines = []
+        for kind, series in (("counter", self.counters), ("gauge", self.gauges)):
+            for name in sorted({name for name, _ in series}):
+                lines.append(f"# TYPE {name} {kind}")
+                for (series_name, labels), value in series.items():
+                    if series_name == name:
+                        lines.append(f"{name}{_format_labels(labels)} {value}")
+
+        for name in sorted({name for name, _ in self.histograms}):
+            lines.append(f"# TYPE {name} histogram")
+            for (series_name, labels), histogram in self.histograms.items():
+                if series_name != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip((*histogram.buckets, "+Inf"), histogram.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels((*labels, ('le', bound)))} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+async def monitor_event_loop(interval: float = 0.5):
+    """Record how late the event loop wakes a sleeping task, forever."""
+    while True:
+        began = time.perf_counter()
+        await asyncio.sleep(interval)
+        metrics.observe("playtime_event_loop_lag_seconds", max(0.0, time.perf_counter() - began - interval))
+
+
+async def serve_metrics(host: str, port: int):
+    """Serve metrics.render() at http://host:port/metrics; returns the aiohttp runner."""
+    from aiohttp import web
+
+    async def handle(request):
+        return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
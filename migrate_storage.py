@@ -0,0 +1,79 @@
+"""Copy a SQLite playtime database into another storage backend.
+
+Run it with the bot stopped. The raw tables (users with their timezones,
+goals, queued goal checks, settings and playtime) are streamed across in
+batches, then every rollup (totals, leaderboards, streaks) is rebuilt on
+the target:
+
+    python migrate_storage.py postgresql://bot@localhost/playtime
+    python migrate_storage.py postgresql://bot@localhost/playtime --source backup.db
+
+Afterwards, point the bot at the target with DATABASE_URL.
+"""
+import argparse
+import asyncio
+import time
+from database import Database
+from storage import DATABASE, create_storage
+
+MIGRATE_BATCH = 20_000
+
+# (table, columns, ORDER BY) for everything that isn't derived from playtime.
+TABLES = (
+    ("users", ("user_id", "username", "dm_channel_id", "timezone"), "user_id"),
+    ("guild_members", ("guild_id", "user_id"), "guild_id, user_id"),
+    ("goals", ("user_id", "goal"), "user_id"),
+    # Before playtime: a SQLite target's goal check trigger can't be switched
+    # off, so it queues a check per copied day of a user with a goal. Those
+    # are ignored if already here, and the next sweep drops the past ones.
+    ("goal_checks", ("user_id", "day"), "user_id, day"),
+    ("settings", ("key", "value"), "key"),
+    # Copied in id order so exports list submissions the way they were made.
+    ("playtime", ("user_id", "day", "playtime"), "id"),
+)
+
+
+async def copy_table(source: Database, target, table: str, columns, order: str, batch: int) -> int:
+    copied = 0
+    async with source.reader() as conn:
+        async with conn.execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY {order}") as cursor:
+            while rows := await cursor.fetchmany(batch):
+                await target.load_rows(table, columns, rows)
+                copied += len(rows)
+                print(f"  {table}: {copied:,} rows", end="\r", flush=True)
+    print(f"  {table}: {copied:,} rows")
+    return copied
+
+
+async def migrate(args):
+    # Opening the source brings an older file up to the current schema first.
+    source = Database(args.source)
+    target = create_storage(args.target)
+    await source.open()
+    try:
+        await target.open()
+        try:
+            if await target.count_playtime():
+                raise SystemExit("The target already has playtime rows; migrate into an empty database.")
+            began = time.perf_counter()
+            for table, columns, order in TABLES:
+                await copy_table(source, target, table, columns, order, args.batch)
+            print("Rebuilding totals and streaks...")
+            await target.rebuild_aggregates()
+            print(f"Done in {time.perf_counter() - began:.1f}s.")
+        finally:
+            await target.close()
+    finally:
+        await source.close()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("target", help="DATABASE_URL of the backend to copy into")
+    parser.add_argument("--source", default=DATABASE, help=f"SQLite file to copy from (default: {DATABASE})")
+    parser.add_argument("--batch", type=int, default=MIGRATE_BATCH, help=f"Rows per batch (default: {MIGRATE_BATCH})")
+    asyncio.run(migrate(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,662 @@
+import contextlib
+import datetime
+import os
+import time
+from metrics import metrics
+from storage import EXPORT_CHUNK_SIZE, STREAKS_QUERY, Storage, due_goals, from_day, prepare_bulk, to_day
+
+POSTGRES_POOL_SIZE = int(os.getenv("POSTGRES_POOL_SIZE", 10))
+
+# Held while migrating so several processes starting at once don't race.
+# Per-user locks use the user id as their key, and no Discord id is 0.
+MIGRATION_LOCK = 0
+
+# The month a day number falls in starts on the 1st; DATE '0001-01-01' is day 1.
+MONTH_START = "{day} - EXTRACT(DAY FROM DATE '0001-01-01' + ({day} - 1))::INTEGER + 1"
+
+BUCKETS = {
+    "day": "day",
+    "week": "day - (day - 1) % 7",
+    "month": MONTH_START.format(day="day"),
+}
+
+# Each entry upgrades the schema by one version, recorded in schema_version.
+# Version 1 is the SQLite schema as of its migration 7.
+MIGRATIONS = (
+    (
+        '''
+        CREATE TABLE users (
+            user_id BIGINT PRIMARY KEY,
+            username TEXT,
+            dm_channel_id BIGINT
+        )
+        ''',
+        '''
+        CREATE TABLE playtime (
+            id BIGSERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            day INTEGER NOT NULL,
+            playtime DOUBLE PRECISION NOT NULL
+        )
+        ''',
+        "CREATE INDEX playtime_user_day ON playtime (user_id, day, playtime)",
+        "CREATE INDEX playtime_day ON playtime (day, playtime)",
+        '''
+        CREATE TABLE goals (
+            user_id BIGINT PRIMARY KEY,
+            goal DOUBLE PRECISION
+        )
+        ''',
+        '''
+        CREATE TABLE settings (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE daily_totals (
+            user_id BIGINT NOT NULL,
+            day INTEGER NOT NULL,
+            total DOUBLE PRECISION NOT NULL,
+            PRIMARY KEY (user_id, day)
+        )
+        ''',
+        "CREATE INDEX daily_totals_rank ON daily_totals (day, total DESC, user_id)",
+        '''
+        CREATE TABLE user_totals (
+            user_id BIGINT PRIMARY KEY,
+            total DOUBLE PRECISION NOT NULL
+        )
+        ''',
+        "CREATE INDEX user_totals_rank ON user_totals (total DESC, user_id)",
+        '''
+        CREATE TABLE day_totals (
+            day INTEGER PRIMARY KEY,
+            total DOUBLE PRECISION NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE period_totals (
+            period TEXT NOT NULL,
+            start_day INTEGER NOT NULL,
+            user_id BIGINT NOT NULL,
+            total DOUBLE PRECISION NOT NULL,
+            PRIMARY KEY (period, start_day, user_id)
+        )
+        ''',
+        "CREATE INDEX period_totals_rank ON period_totals (period, start_day, total DESC, user_id)",
+        '''
+        CREATE TABLE streaks (
+            user_id BIGINT PRIMARY KEY,
+            last_day INTEGER NOT NULL,
+            current INTEGER NOT NULL,
+            longest INTEGER NOT NULL
+        )
+        ''',
+        "CREATE INDEX streaks_longest ON streaks (longest DESC, user_id)",
+        "CREATE INDEX streaks_current ON streaks (current DESC, user_id)",
+        '''
+        CREATE TABLE guild_members (
+            guild_id BIGINT NOT NULL,
+            user_id BIGINT NOT NULL,
+            PRIMARY KEY (guild_id, user_id)
+        )
+        ''',
+        f'''
+        CREATE FUNCTION playtime_rollup() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO daily_totals (user_id, day, total) VALUES (NEW.user_id, NEW.day, NEW.playtime)
+                ON CONFLICT (user_id, day) DO UPDATE SET total = daily_totals.total + excluded.total;
+                INSERT INTO user_totals (user_id, total) VALUES (NEW.user_id, NEW.playtime)
+                ON CONFLICT (user_id) DO UPDATE SET total = user_totals.total + excluded.total;
+                INSERT INTO day_totals (day, total) VALUES (NEW.day, NEW.playtime)
+                ON CONFLICT (day) DO UPDATE SET total = day_totals.total + excluded.total;
+                INSERT INTO period_totals (period, start_day, user_id, total)
+                VALUES ('week', NEW.day - (NEW.day - 1) % 7, NEW.user_id, NEW.playtime)
+                ON CONFLICT (period, start_day, user_id) DO UPDATE SET total = period_totals.total + excluded.total;
+                INSERT INTO period_totals (period, start_day, user_id, total)
+                VALUES ('month', {MONTH_START.format(day="NEW.day")}, NEW.user_id, NEW.playtime)
+                ON CONFLICT (period, start_day, user_id) DO UPDATE SET total = period_totals.total + excluded.total;
+                RETURN NEW;
+            END IF;
+            UPDATE daily_totals SET total = total - OLD.playtime WHERE user_id = OLD.user_id AND day = OLD.day;
+            UPDATE user_totals SET total = total - OLD.playtime WHERE user_id = OLD.user_id;
+            UPDATE day_totals SET total = total - OLD.playtime WHERE day = OLD.day;
+            UPDATE period_totals SET total = total - OLD.playtime
+            WHERE period = 'week' AND start_day = OLD.day - (OLD.day - 1) % 7 AND user_id = OLD.user_id;
+            UPDATE period_totals SET total = total - OLD.playtime
+            WHERE period = 'month' AND start_day = {MONTH_START.format(day="OLD.day")} AND user_id = OLD.user_id;
+            RETURN OLD;
+        END
+        $$
+        ''',
+        '''
+        CREATE TRIGGER playtime_rollup AFTER INSERT OR DELETE ON playtime
+        FOR EACH ROW EXECUTE FUNCTION playtime_rollup()
+        ''',
+    ),
+    # 2: SQLite's migration 8, per-user timezones and the goal check queue.
+    (
+        "ALTER TABLE users ADD COLUMN timezone TEXT",
+        '''
+        CREATE TABLE goal_checks (
+            user_id BIGINT NOT NULL,
+            day INTEGER NOT NULL,
+            PRIMARY KEY (user_id, day)
+        )
+        ''',
+        '''
+        CREATE FUNCTION playtime_goal_check() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            IF EXISTS (SELECT 1 FROM goals WHERE user_id = NEW.user_id) THEN
+                INSERT INTO goal_checks (user_id, day) VALUES (NEW.user_id, NEW.day) ON CONFLICT DO NOTHING;
+            END IF;
+            RETURN NEW;
+        END
+        $$
+        ''',
+        '''
+        CREATE TRIGGER playtime_goal_check AFTER INSERT ON playtime
+        FOR EACH ROW EXECUTE FUNCTION playtime_goal_check()
+        ''',
+        '''
+        INSERT INTO goal_checks (user_id, day)
+        SELECT goals.user_id, MAX(daily_totals.day) FROM goals
+        JOIN daily_totals ON daily_totals.user_id = goals.user_id
+        GROUP BY goals.user_id
+        ''',
+    ),
+    # 3: SQLite's migration 9, per-user data versions.
+    (
+        "ALTER TABLE users ADD COLUMN version BIGINT NOT NULL DEFAULT 0",
+        '''
+        CREATE FUNCTION playtime_version() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            UPDATE users SET version = version + 1
+            WHERE user_id = CASE WHEN TG_OP = 'INSERT' THEN NEW.user_id ELSE OLD.user_id END;
+            RETURN NULL;
+        END
+        $$
+        ''',
+        '''
+        CREATE TRIGGER playtime_version AFTER INSERT OR DELETE ON playtime
+        FOR EACH ROW EXECUTE FUNCTION playtime_version()
+        ''',
+    ),
+    # 4: SQLite's migration 10, one data version for everyone. It is bumped
+    # once per statement, so a bulk import doesn't update the row per row.
+    (
+        "CREATE TABLE data_version (version BIGINT NOT NULL)",
+        "INSERT INTO data_version (version) SELECT COALESCE(SUM(version), 0) FROM users",
+        '''
+        CREATE FUNCTION playtime_data_version() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            UPDATE data_version SET version = version + 1;
+            RETURN NULL;
+        END
+        $$
+        ''',
+        '''
+        CREATE TRIGGER playtime_data_version AFTER INSERT OR DELETE ON playtime
+        FOR EACH STATEMENT EXECUTE FUNCTION playtime_data_version()
+        ''',
+    ),
+)
+
+UPSERT_STREAKS = (
+    "INSERT INTO streaks (user_id, last_day, current, longest) {query} "
+    "ON CONFLICT (user_id) DO UPDATE SET "
+    "last_day = excluded.last_day, current = excluded.current, longest = excluded.longest"
+)
+
+REBUILD_AGGREGATES = (
+    "TRUNCATE daily_totals, user_totals, day_totals, period_totals, streaks",
+    '''
+    INSERT INTO daily_totals (user_id, day, total)
+    SELECT user_id, day, SUM(playtime) FROM playtime GROUP BY user_id, day
+    ''',
+    '''
+    INSERT INTO user_totals (user_id, total)
+    SELECT user_id, SUM(playtime) FROM playtime GROUP BY user_id
+    ''',
+    '''
+    INSERT INTO day_totals (day, total)
+    SELECT day, SUM(playtime) FROM playtime GROUP BY day
+    ''',
+    f'''
+    INSERT INTO period_totals (period, start_day, user_id, total)
+    SELECT 'week', {BUCKETS["week"]} AS start_day, user_id, SUM(total)
+    FROM daily_totals GROUP BY start_day, user_id
+    ''',
+    f'''
+    INSERT INTO period_totals (period, start_day, user_id, total)
+    SELECT 'month', {BUCKETS["month"]} AS start_day, user_id, SUM(total)
+    FROM daily_totals GROUP BY start_day, user_id
+    ''',
+    "INSERT INTO streaks (user_id, last_day, current, longest) " + STREAKS_QUERY.format(where=""),
+    "UPDATE users SET version = version + 1",
+    "UPDATE data_version SET version = version + 1",
+)
+
+
+class Params:
+    """Collects query parameters, handing back the $n placeholder for each."""
+
+    def __init__(self, *values):
+        self.values = list(values)
+
+    def __call__(self, value) -> str:
+        self.values.append(value)
+        return f"${len(self.values)}"
+
+
+def _ranking_source(window: str, today: datetime.date, guild_id: int, params: Params):
+    """PostgreSQL version of database._ranking_source; returns the FROM and WHERE clauses."""
+    tables = {"all": "user_totals", "today": "daily_totals", "week": "period_totals", "month": "period_totals"}
+    if window not in tables:
+        raise ValueError(f"Unknown leaderboard window {window!r}")
+    source = f"{tables[window]} t"
+    if guild_id is not None:
+        source += f" JOIN guild_members g ON g.user_id = t.user_id AND g.guild_id = {params(guild_id)}"
+
+    day = to_day(today)
+    if window == "all":
+        where = "TRUE"
+    elif window == "today":
+        where = f"t.day = {params(day)}"
+    elif window == "week":
+        where = f"t.period = 'week' AND t.start_day = {params(day - (day - 1) % 7)}"
+    else:
+        where = f"t.period = 'month' AND t.start_day = {params(to_day(today.replace(day=1)))}"
+    return source, where
+
+
+class PostgresDatabase(Storage):
+    """PostgreSQL storage over an asyncpg connection pool.
+
+    Unlike SQLite, PostgreSQL runs writers concurrently, so every submission
+    is its own transaction and there is no write batching. A transaction-level
+    advisory lock per user keeps one user's submissions (and streak updates)
+    in order.
+    """
+
+    def __init__(self, dsn: str, pool_size: int = POSTGRES_POOL_SIZE):
+        super().__init__()
+        self.dsn = dsn
+        self.pool_size = pool_size
+        self._pool = None
+
+    async def open(self):
+        try:
+            import asyncpg
+        except ImportError:
+            raise RuntimeError("PostgreSQL storage needs the optional `asyncpg` package.") from None
+        self._pool = await asyncpg.create_pool(self.dsn, min_size=1, max_size=self.pool_size)
+        await self.initialize()
+
+    async def close(self):
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    async def initialize(self):
+        async with self.transaction() as conn:
+            await conn.execute("SELECT pg_advisory_xact_lock($1)", MIGRATION_LOCK)
+            await conn.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+            version = await conn.fetchval("SELECT MAX(version) FROM schema_version") or 0
+            for number, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+                for statement in statements:
+                    await conn.execute(statement)
+                await conn.execute("INSERT INTO schema_version (version) VALUES ($1)", number)
+                print(f"Migrated PostgreSQL database to schema version {number}.")
+
+    @contextlib.asynccontextmanager
+    async def connection(self):
+        began = time.perf_counter()
+        try:
+            async with self._pool.acquire() as conn:
+                yield conn
+        finally:
+            metrics.record_query(time.perf_counter() - began)
+
+    @contextlib.asynccontextmanager
+    async def transaction(self):
+        async with self.connection() as conn:
+            async with conn.transaction():
+                yield conn
+
+    async def fetchrow(self, sql: str, *params):
+        async with self.connection() as conn:
+            return await conn.fetchrow(sql, *params)
+
+    async def fetchval(self, sql: str, *params):
+        async with self.connection() as conn:
+            return await conn.fetchval(sql, *params)
+
+    async def fetch(self, sql: str, *params):
+        async with self.connection() as conn:
+            return await conn.fetch(sql, *params)
+
+    async def execute(self, sql: str, *params):
+        async with self.connection() as conn:
+            return await conn.execute(sql, *params)
+
+    async def data_version(self, user_ids=None):
+        if user_ids is None:
+            return await self.fetchval("SELECT version FROM data_version")
+        return await self.fetchval(
+            "SELECT COALESCE(SUM(version), 0)::BIGINT FROM users WHERE user_id = ANY($1::BIGINT[])", list(user_ids)
+        )
+
+    # Playtime
+
+    async def add_playtime(self, user_id: int, username: str, playtime: float, date: datetime.date,
+                           guild_id: int = None) -> float:
+        day = to_day(date)
+        async with self.transaction() as conn:
+            await conn.execute("SELECT pg_advisory_xact_lock($1)", user_id)
+            await conn.execute(
+                "INSERT INTO users (user_id, username) VALUES ($1, $2) "
+                "ON CONFLICT (user_id) DO UPDATE SET username = excluded.username",
+                user_id, username
+            )
+            if guild_id is not None:
+                await conn.execute(
+                    "INSERT INTO guild_members (guild_id, user_id) VALUES ($1, $2) ON CONFLICT DO NOTHING",
+                    guild_id, user_id
+                )
+            await conn.execute("INSERT INTO playtime (user_id, day, playtime) VALUES ($1, $2, $3)", user_id, day, playtime)
+            daily_total = await conn.fetchval(
+                "SELECT total FROM daily_totals WHERE user_id = $1 AND day = $2", user_id, day
+            )
+            await self._update_streak(conn, user_id, day, new_day=daily_total == playtime)
+        return daily_total
+
+    async def add_playtime_bulk(self, rows, guild_id: int = None):
+        usernames, prepared, days = prepare_bulk(rows)
+        user_ids = list(usernames)
+        columns = [list(column) for column in zip(*prepared)] or [[], [], []]
+
+        async with self.transaction() as conn:
+            # Always lock users in id order so two overlapping imports can't deadlock.
+            await conn.execute(
+                "SELECT pg_advisory_xact_lock(id) FROM (SELECT unnest($1::BIGINT[]) AS id ORDER BY id) ids", user_ids
+            )
+            await conn.executemany(
+                "INSERT INTO users (user_id, username) VALUES ($1, $2) "
+                "ON CONFLICT (user_id) DO UPDATE SET username = excluded.username",
+                usernames.items()
+            )
+            if guild_id is not None:
+                await conn.execute(
+                    "INSERT INTO guild_members (guild_id, user_id) SELECT $1, id FROM unnest($2::BIGINT[]) id "
+                    "ON CONFLICT DO NOTHING",
+                    guild_id, user_ids
+                )
+            status = await conn.execute(
+                "DELETE FROM playtime p USING unnest($1::BIGINT[], $2::INTEGER[]) AS d (user_id, day) "
+                "WHERE p.user_id = d.user_id AND p.day = d.day",
+                *([list(column) for column in zip(*days)] or [[], []])
+            )
+            replaced = int(status.split()[-1])
+            await conn.execute(
+                "INSERT INTO playtime (user_id, day, playtime) "
+                "SELECT * FROM unnest($1::BIGINT[], $2::INTEGER[], $3::DOUBLE PRECISION[])",
+                *columns
+            )
+            await conn.execute(
+                UPSERT_STREAKS.format(query=STREAKS_QUERY.format(where="WHERE user_id = ANY($1::BIGINT[])")),
+                user_ids
+            )
+        return len(prepared), replaced
+
+    async def _update_streak(self, conn, user_id: int, day: int, new_day: bool):
+        row = await conn.fetchrow("SELECT last_day, current, longest FROM streaks WHERE user_id = $1", user_id)
+        if row is None:
+            await conn.execute(
+                "INSERT INTO streaks (user_id, last_day, current, longest) VALUES ($1, $2, 1, 1)", user_id, day
+            )
+            return
+
+        last_day, current, longest = row
+        if day == last_day or (day < last_day and not new_day):
+            return
+        if day > last_day:
+            current = current + 1 if day == last_day + 1 else 1
+            await conn.execute(
+                "UPDATE streaks SET last_day = $1, current = $2, longest = $3 WHERE user_id = $4",
+                day, current, max(longest, current), user_id
+            )
+            return
+        await conn.execute(
+            UPSERT_STREAKS.format(query=STREAKS_QUERY.format(where="WHERE user_id = $1")), user_id
+        )
+
+    async def iter_history(self, user_id: int = None, start: datetime.date = None, end: datetime.date = None,
+                           chunk_size: int = EXPORT_CHUNK_SIZE):
+        params = Params()
+        clauses = []
+        if user_id is not None:
+            clauses.append(f"user_id = {params(user_id)}")
+        if start is not None:
+            clauses.append(f"day >= {params(to_day(start))}")
+        if end is not None:
+            clauses.append(f"day <= {params(to_day(end))}")
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        order = "day, id" if user_id is not None else "id"
+
+        # Server-side cursors only live inside a transaction.
+        async with self.transaction() as conn:
+            cursor = await conn.cursor(
+                f"SELECT user_id, day, playtime FROM playtime {where} ORDER BY {order}", *params.values
+            )
+            while rows := await cursor.fetch(chunk_size):
+                yield [(row_user_id, from_day(day), playtime) for row_user_id, day, playtime in rows]
+
+    async def count_playtime(self) -> int:
+        return (await self.fetchrow("SELECT COUNT(*) FROM playtime"))[0]
+
+    async def load_rows(self, table: str, columns, rows):
+        async with self.transaction() as conn:
+            if table == "playtime":
+                # Per-row triggers would dominate a bulk copy. rebuild_aggregates redoes the
+                # rollups in one pass, and goal_checks is copied over as it is.
+                await conn.execute("ALTER TABLE playtime DISABLE TRIGGER USER")
+            await conn.copy_records_to_table(table, records=rows, columns=columns)
+            if table == "playtime":
+                await conn.execute("ALTER TABLE playtime ENABLE TRIGGER USER")
+
+    # Aggregates
+
+    async def daily_total(self, user_id: int, date: datetime.date) -> float:
+        row = await self.fetchrow(
+            "SELECT total FROM daily_totals WHERE user_id = $1 AND day = $2", user_id, to_day(date)
+        )
+        return row[0] if row else 0
+
+    async def totals_by_period(self, user_id: int = None, start: datetime.date = None,
+                               end: datetime.date = None, granularity: str = "day"):
+        bucket = BUCKETS[granularity]
+        params = Params()
+        clauses = []
+        if user_id is not None:
+            source = "daily_totals"
+            clauses.append(f"user_id = {params(user_id)}")
+        else:
+            source = "day_totals"
+        if start is not None:
+            clauses.append(f"day >= {params(to_day(start))}")
+        if end is not None:
+            clauses.append(f"day <= {params(to_day(end))}")
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        if granularity == "day":
+            query = f"SELECT day, total FROM {source} {where} ORDER BY day"
+        else:
+            query = f"SELECT {bucket} AS bucket, SUM(total) FROM {source} {where} GROUP BY bucket ORDER BY bucket"
+        return [tuple(row) for row in await self.fetch(query, *params.values)]
+
+    async def totals_by_period_for(self, user_ids, start: datetime.date = None, end: datetime.date = None,
+                                   granularity: str = "day"):
+        bucket = BUCKETS[granularity]
+        params = Params()
+        clauses = [f"user_id = ANY({params(list(user_ids))}::BIGINT[])"]
+        if start is not None:
+            clauses.append(f"day >= {params(to_day(start))}")
+        if end is not None:
+            clauses.append(f"day <= {params(to_day(end))}")
+        rows = await self.fetch(
+            f"SELECT user_id, {bucket} AS bucket, SUM(total) FROM daily_totals WHERE {' AND '.join(clauses)} "
+            "GROUP BY user_id, bucket ORDER BY user_id, bucket",
+            *params.values
+        )
+        return [tuple(row) for row in rows]
+
+    async def leaderboard(self, window: str, today: datetime.date, limit: int, guild_id: int = None,
+                          after=None):
+        params = Params()
+        source, where = _ranking_source(window, today, guild_id, params)
+        if after is not None:
+            total, user_id = params(after[0]), params(after[1])
+            where += f" AND (t.total < {total} OR (t.total = {total} AND t.user_id > {user_id}))"
+        rows = await self.fetch(
+            f"SELECT t.user_id, users.username, t.total FROM {source} "
+            f"JOIN users ON users.user_id = t.user_id WHERE {where} "
+            f"ORDER BY t.total DESC, t.user_id LIMIT {params(limit)}",
+            *params.values
+        )
+        return [tuple(row) for row in rows]
+
+    async def leaderboard_rank(self, user_id: int, window: str, today: datetime.date, guild_id: int = None):
+        params = Params()
+        source, where = _ranking_source(window, today, guild_id, params)
+        row = await self.fetchrow(
+            f"SELECT t.total FROM {source} WHERE {where} AND t.user_id = {params(user_id)}", *params.values
+        )
+        if row is None:
+            return None
+        params = Params()
+        source, where = _ranking_source(window, today, guild_id, params)
+        above = await self.fetchrow(
+            f"SELECT COUNT(*) FROM {source} WHERE {where} AND t.total > {params(row[0])}", *params.values
+        )
+        return above[0] + 1, row[0]
+
+    async def get_streak(self, user_id: int):
+        row = await self.fetchrow("SELECT current, longest FROM streaks WHERE user_id = $1", user_id)
+        return tuple(row) if row else None
+
+    async def streak_leaderboard(self, limit: int, active_since: datetime.date = None):
+        if active_since is None:
+            rows = await self.fetch(
+                "SELECT users.username, streaks.longest FROM streaks "
+                "JOIN users ON users.user_id = streaks.user_id "
+                "ORDER BY streaks.longest DESC, streaks.user_id LIMIT $1",
+                limit
+            )
+        else:
+            rows = await self.fetch(
+                "SELECT users.username, streaks.current FROM streaks "
+                "JOIN users ON users.user_id = streaks.user_id "
+                "WHERE streaks.last_day >= $1 "
+                "ORDER BY streaks.current DESC, streaks.user_id LIMIT $2",
+                to_day(active_since), limit
+            )
+        return [tuple(row) for row in rows]
+
+    async def rebuild_aggregates(self):
+        async with self.transaction() as conn:
+            for statement in REBUILD_AGGREGATES:
+                await conn.execute(statement)
+
+    # Users
+
+    async def get_users(self, user_ids):
+        rows = await self.fetch(
+            "SELECT user_id, username, dm_channel_id, timezone FROM users WHERE user_id = ANY($1::BIGINT[])",
+            list(user_ids)
+        )
+        return [tuple(row) for row in rows]
+
+    async def rename_user(self, user_id: int, username: str):
+        await self.execute(
+            "UPDATE users SET username = $1 WHERE user_id = $2 AND username IS DISTINCT FROM $1", username, user_id
+        )
+
+    async def set_dm_channel(self, user_id: int, channel_id: int):
+        await self.execute("UPDATE users SET dm_channel_id = $1 WHERE user_id = $2", channel_id, user_id)
+
+    async def set_timezone(self, user_id: int, username: str, timezone: str):
+        await self.execute(
+            "INSERT INTO users (user_id, username, timezone) VALUES ($1, $2, $3) "
+            "ON CONFLICT (user_id) DO UPDATE SET username = excluded.username, timezone = excluded.timezone",
+            user_id, username, timezone
+        )
+
+    # Settings
+
+    async def get_setting(self, key: str):
+        row = await self.fetchrow("SELECT value FROM settings WHERE key = $1", key)
+        return row[0] if row else None
+
+    async def set_setting(self, key: str, value: str):
+        await self.execute(
+            "INSERT INTO settings (key, value) VALUES ($1, $2) ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+            key, value
+        )
+
+    # Goals
+
+    async def set_goal(self, user_id: int, goal: float):
+        async with self.transaction() as conn:
+            await conn.execute(
+                "INSERT INTO goals (user_id, goal) VALUES ($1, $2) ON CONFLICT (user_id) DO UPDATE SET goal = excluded.goal",
+                user_id, goal
+            )
+            await conn.execute(
+                "INSERT INTO goal_checks (user_id, day) "
+                "SELECT user_id, MAX(day) FROM daily_totals WHERE user_id = $1 GROUP BY user_id "
+                "ON CONFLICT DO NOTHING",
+                user_id
+            )
+
+    async def get_goal(self, user_id: int):
+        row = await self.fetchrow("SELECT goal FROM goals WHERE user_id = $1", user_id)
+        return row[0] if row else None
+
+    async def claim_goal(self, user_id: int, total: float):
+        row = await self.fetchrow("DELETE FROM goals WHERE user_id = $1 AND goal <= $2 RETURNING goal", user_id, total)
+        return row[0] if row else None
+
+    async def claim_met_goals(self, shard_ids=None, shard_count: int = None):
+        params = Params()
+        shard = ""
+        if shard_ids is not None:
+            shard = f"WHERE goal_checks.user_id % {params(shard_count)} = ANY({params(list(shard_ids))}::BIGINT[]) "
+        async with self.transaction() as conn:
+            # SKIP LOCKED hands a check to only one of several concurrent sweeps.
+            checks = await conn.fetch(
+                "SELECT goal_checks.user_id, goal_checks.day, users.timezone, goals.goal, daily_totals.total "
+                "FROM goal_checks "
+                "LEFT JOIN users ON users.user_id = goal_checks.user_id "
+                "LEFT JOIN goals ON goals.user_id = goal_checks.user_id "
+                "LEFT JOIN daily_totals ON daily_totals.user_id = goal_checks.user_id "
+                f"AND daily_totals.day = goal_checks.day {shard}"
+                "FOR UPDATE OF goal_checks SKIP LOCKED",
+                *params.values
+            )
+            met, done = due_goals(checks)
+            if done:
+                await conn.execute(
+                    "DELETE FROM goal_checks USING unnest($1::BIGINT[], $2::INTEGER[]) AS d (user_id, day) "
+                    "WHERE goal_checks.user_id = d.user_id AND goal_checks.day = d.day",
+                    *map(list, zip(*done))
+                )
+            # claim_goal may have taken some of these meanwhile; only goals this DELETE removed count.
+            claimed = {
+                row[0] for row in await conn.fetch(
+                    "DELETE FROM goals WHERE user_id = ANY($1::BIGINT[]) RETURNING user_id",
+                    [user_id for user_id, _, _ in met]
+                )
+            }
+        return [row for row in met if row[0] in claimed]
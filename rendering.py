@@ -0,0 +1,195 @@
+import asyncio
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from metrics import metrics
+
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", 2))
+RENDER_QUEUE_LIMIT = int(os.getenv("RENDER_QUEUE_LIMIT", 16))
+# Series longer than this are downsampled before plotting, which keeps render
+# time flat no matter how much history a chart covers.
+MAX_CHART_POINTS = int(os.getenv("MAX_CHART_POINTS", 500))
+# Markers only help when the individual points can still be told apart.
+MARKER_POINTS = 60
+# Rolling averages in /compare cover this many buckets (days, weeks or months).
+ROLLING_WINDOW = 7
+COMPARE_MODES = ("daily", "cumulative", "rolling")
+# date.toordinal() of 1970-01-01, for turning day numbers into datetime64.
+EPOCH_DAY = 719163
+
+
+class RendererBusy(Exception):
+    """Raised when more charts are waiting to be rendered than the queue allows."""
+
+
+# matplotlib (and numpy, PIL and the font cache behind it) is only ever
+# imported inside the worker processes, so it costs the bot nothing at startup.
+def _init_worker():
+    import matplotlib
+    matplotlib.use("Agg")
+    from matplotlib.figure import Figure
+    # Drawing one throwaway figure loads the font cache before the first real request.
+    Figure().savefig(io.BytesIO(), format='png')
+
+
+def _ready() -> bool:
+    return True
+
+
+def downsample(x, y, threshold: int):
+    """Largest-Triangle-Three-Buckets: pick ``threshold`` points of (x, y) that keep its shape.
+
+    The first and last points are always kept; in between, each bucket
+    contributes the point forming the largest triangle with the previously
+    chosen point and the average of the next bucket, which preserves peaks
+    that plain striding would skip over.
+    """
+    import numpy as np
+
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return x, y
+    every = (n - 2) / (threshold - 2)
+    chosen = np.empty(threshold, dtype=np.int64)
+    chosen[0], chosen[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start = int(i * every) + 1
+        stop = int((i + 1) * every) + 1
+        following = slice(stop, min(int((i + 2) * every) + 1, n))
+        avg_x, avg_y = x[following].mean(), y[following].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:stop] - y[a]) - (x[a] - x[start:stop]) * (avg_y - y[a]))
+        a = start + int(area.argmax())
+        chosen[i + 1] = a
+    return x[chosen], y[chosen]
+
+
+def _plot(series, title: str, ylabel: str) -> bytes:
+    import numpy as np
+    from matplotlib.figure import Figure
+    from matplotlib.dates import DateFormatter
+
+    fig = Figure(figsize=(10, 5))
+    ax = fig.add_subplot()
+    for label, days, values, color in series:
+        x = np.asarray(days, dtype=np.float64)
+        y = np.asarray(values, dtype=np.float64)
+        x, y = downsample(x, y, MAX_CHART_POINTS)
+        dates = (x.astype(np.int64) - EPOCH_DAY).astype("datetime64[D]")
+        marker = 'o' if len(x) <= MARKER_POINTS else None
+        ax.plot(dates, y, marker=marker, linestyle='-', color=color, label=label)
+    ax.set_xlabel("Date")
+    ax.set_ylabel(ylabel)
+    ax.set_title(title)
+    ax.grid(True)
+    ax.legend()
+    ax.xaxis.set_major_formatter(DateFormatter('%d %b, %Y'))
+    fig.tight_layout()
+
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png')
+    return buf.getvalue()
+
+
+def render_line_chart(series, title: str, ylabel: str) -> bytes:
+    """Draw ``series`` as a line chart and return it as PNG bytes.
+
+    Runs inside a worker process, so it only uses the object-oriented Figure
+    API and never touches pyplot's global state. Each entry of ``series`` is
+    ``(label, days, values, color)`` with days as date.toordinal() numbers;
+    a color of None uses the default cycle.
+    """
+    return _plot(series, title, ylabel)
+
+
+def dense_matrix(user_ids, rows, granularity: str):
+    """Align (user_id, day, total) rows into a users x buckets matrix.
+
+    Returns the bucket day numbers and the matrix, with one row per entry of
+    ``user_ids`` and zeros wherever a user has nothing in a bucket. Days and
+    weeks are evenly spaced, so their axis covers every bucket in the range;
+    months aren't, so only months someone played in get a column.
+    """
+    import numpy as np
+
+    ids = np.asarray(user_ids, dtype=np.int64)
+    owners, days, totals = (np.asarray(column) for column in zip(*rows))
+    if granularity == "month":
+        axis = np.unique(days)
+    else:
+        axis = np.arange(days.min(), days.max() + 1, 7 if granularity == "week" else 1)
+
+    order = np.argsort(ids)
+    matrix = np.zeros((len(ids), len(axis)))
+    matrix[order[np.searchsorted(ids[order], owners)], np.searchsorted(axis, days)] = totals
+    return axis, matrix
+
+
+def apply_mode(matrix, mode: str):
+    """Turn per-bucket totals into running totals or trailing ROLLING_WINDOW averages, row-wise."""
+    import numpy as np
+
+    if mode == "cumulative":
+        return matrix.cumsum(axis=1)
+    if mode == "rolling":
+        sums = np.pad(matrix, ((0, 0), (1, 0))).cumsum(axis=1)
+        upper = np.arange(1, matrix.shape[1] + 1)
+        lower = np.maximum(upper - ROLLING_WINDOW, 0)
+        return (sums[:, upper] - sums[:, lower]) / (upper - lower)
+    return matrix
+
+
+def render_comparison_chart(labels, user_ids, rows, granularity: str, mode: str, title: str,
+                            ylabel: str) -> bytes:
+    """Line chart of several users' totals, aligned on a shared date axis; see dense_matrix."""
+    axis, matrix = dense_matrix(user_ids, rows, granularity)
+    matrix = apply_mode(matrix, mode)
+    return _plot([(label, axis, values, None) for label, values in zip(labels, matrix)], title, ylabel)
+
+
+class ChartRenderer:
+    """Renders charts in a process pool so the event loop never blocks on matplotlib."""
+
+    def __init__(self, workers: int = RENDER_WORKERS, queue_limit: int = RENDER_QUEUE_LIMIT):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.pending = 0
+        self._executor = None
+
+    def start(self):
+        # spawn rather than fork: the bot process already has aiosqlite and
+        # aiohttp threads running, which forked children would inherit.
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+        )
+        # Workers are spawned on demand; queue one no-op each so they start
+        # warming up in the background instead of on the first /graph.
+        for _ in range(self.workers):
+            self._executor.submit(_ready)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def _run(self, func, *args) -> bytes:
+        if self.pending >= self.queue_limit:
+            raise RendererBusy(f"{self.pending} charts are already queued")
+        self.pending += 1
+        metrics.set_gauge("playtime_render_queue_depth", self.pending)
+        try:
+            with metrics.timer("playtime_render_seconds", chart=func.__name__):
+                return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+        finally:
+            self.pending -= 1
+            metrics.set_gauge("playtime_render_queue_depth", self.pending)
+
+    async def line_chart(self, series, title: str, ylabel: str) -> bytes:
+        return await self._run(render_line_chart, series, title, ylabel)
+
+    async def comparison_chart(self, labels, user_ids, rows, granularity: str, mode: str, title: str,
+                               ylabel: str) -> bytes:
+        return await self._run(render_comparison_chart, labels, user_ids, rows, granularity, mode, title, ylabel)
@@ -0,0 +1,267 @@
+import abc
+import datetime
+import math
+import os
+import zoneinfo
+
+DATABASE = "playtime.db"
+# A file path for SQLite, or a postgresql:// URL to use PostgreSQL instead.
+DATABASE_URL = os.getenv("DATABASE_URL", DATABASE)
+
+EXPORT_CHUNK_SIZE = 5000
+LEADERBOARD_WINDOWS = ("today", "week", "month", "all")
+GRANULARITIES = ("day", "week", "month")
+
+# Gaps and islands: consecutive days share the same day - row_number() value,
+# so grouping on it yields one row per unbroken run of days. Both backends
+# run it as is, so it sticks to SQL that SQLite and PostgreSQL share.
+STREAKS_QUERY = '''
+    WITH islands AS (
+        SELECT user_id, day, day - ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY day) AS island
+        FROM daily_totals {where}
+    ), runs AS (
+        SELECT user_id, MAX(day) AS last_day, COUNT(*) AS length
+        FROM islands GROUP BY user_id, island
+    ), ranked AS (
+        SELECT user_id, last_day, length,
+               MAX(length) OVER (PARTITION BY user_id) AS longest,
+               ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY last_day DESC) AS recency
+        FROM runs
+    )
+    SELECT user_id, last_day, length, longest FROM ranked WHERE recency = 1
+'''
+
+
+def to_day(date: datetime.date) -> int:
+    return date.toordinal()
+
+
+def from_day(day: int) -> datetime.date:
+    return datetime.date.fromordinal(day)
+
+
+def local_today(timezone: str = None) -> datetime.date:
+    """Today's date in ``timezone`` (an IANA name), or in the server's own if None."""
+    if timezone is None:
+        return datetime.date.today()
+    return datetime.datetime.now(zoneinfo.ZoneInfo(timezone)).date()
+
+
+def validate_playtime(playtime: float):
+    if not math.isfinite(playtime) or playtime < 0:
+        raise ValueError(f"Playtime must be a non-negative number of hours, got {playtime}")
+
+
+def prepare_bulk(rows):
+    """Validate (user_id, username, date, playtime) rows for add_playtime_bulk.
+
+    Returns the latest username per user, the rows as (user_id, day, playtime)
+    and the distinct (user_id, day) pairs they cover. A bad row raises a
+    ValueError naming it.
+    """
+    usernames = {}
+    prepared = []
+    for number, (user_id, username, date, playtime) in enumerate(rows, start=1):
+        try:
+            validate_playtime(playtime)
+        except ValueError as e:
+            raise ValueError(f"Row {number}: {e}") from None
+        usernames[user_id] = username
+        prepared.append((user_id, to_day(date), playtime))
+    return usernames, prepared, list(dict.fromkeys(row[:2] for row in prepared))
+
+
+def due_goals(checks):
+    """Decide queued goal checks given as (user_id, day, timezone, goal, total) rows.
+
+    Returns the (user_id, goal, total) goals met on their user's local today
+    and the (user_id, day) checks that are finished with; checks for days
+    still in the user's future are left for later.
+    """
+    todays = {}
+    met, done = [], []
+    for user_id, day, timezone, goal, total in checks:
+        if timezone not in todays:
+            todays[timezone] = to_day(local_today(timezone))
+        today = todays[timezone]
+        if day > today:
+            continue
+        done.append((user_id, day))
+        if day == today and goal is not None and total is not None and total >= goal:
+            met.append((user_id, goal, total))
+    return met, done
+
+
+class Storage(abc.ABC):
+    """Everything the bot stores or reads, whichever database is behind it.
+
+    Days cross this interface as date objects and leave the chart queries as
+    date.toordinal() day numbers. A submission's day is the calendar day in
+    the submitter's timezone, fixed when it is written, so every query reads
+    plain day numbers and timezones never reach SQL. Implementations keep the
+    rollup tables (daily, per-user, per-day, weekly/monthly and streaks)
+    current on every write, so reads never aggregate raw submissions.
+    """
+
+    @abc.abstractmethod
+    async def open(self):
+        """Connect, creating or upgrading the schema as needed."""
+
+    @abc.abstractmethod
+    async def close(self):
+        ...
+
+    @abc.abstractmethod
+    async def data_version(self, user_ids=None):
+        """Token that changes whenever any of ``user_ids``' playtime changes (anyone's, for None).
+
+        Every write to a user's playtime bumps their users.version and the
+        single row of data_version, so writes made by other processes sharing
+        the database count too. The token is the sum of users.version over the
+        users asked about, or data_version's one row for everyone, which keeps
+        the everyone token a single-row read. Read it before the data it
+        guards; a cached result is then never older than its token.
+        """
+
+    # Submissions
+
+    @abc.abstractmethod
+    async def add_playtime(self, user_id: int, username: str, playtime: float, date: datetime.date,
+                           guild_id: int = None) -> float:
+        """Record a submission and return the user's new total for that day."""
+
+    @abc.abstractmethod
+    async def add_playtime_bulk(self, rows, guild_id: int = None):
+        """Store many (user_id, username, date, playtime) rows at once; see prepare_bulk.
+
+        The rows replace whatever their users already have stored on the days
+        they cover, so importing the same export twice (or one overlapping
+        earlier submissions) leaves those days as the file has them instead
+        of counting anything twice. Every row is kept, even ones with equal
+        values: they are separate sessions. Returns (inserted, replaced), the
+        number of rows written and of stored rows they replaced.
+        """
+
+    @abc.abstractmethod
+    async def iter_history(self, user_id: int = None, start: datetime.date = None, end: datetime.date = None,
+                           chunk_size: int = EXPORT_CHUNK_SIZE):
+        """Yield raw submissions as lists of (user_id, date, playtime) without loading them all."""
+
+    @abc.abstractmethod
+    async def count_playtime(self) -> int:
+        """Number of raw submissions stored."""
+
+    @abc.abstractmethod
+    async def load_rows(self, table: str, columns, rows):
+        """Append raw rows to ``table`` as fast as the backend allows, for migrate_storage.py.
+
+        Rollups are not maintained; call rebuild_aggregates afterwards.
+        """
+
+    # Aggregates
+
+    @abc.abstractmethod
+    async def daily_total(self, user_id: int, date: datetime.date) -> float:
+        ...
+
+    @abc.abstractmethod
+    async def totals_by_period(self, user_id: int = None, start: datetime.date = None,
+                               end: datetime.date = None, granularity: str = "day"):
+        """Playtime summed per day, week or month as (first day number, total) rows in order.
+
+        ``start``/``end`` bound the days included; buckets at the edges only
+        cover the days inside the range. Weeks start on Monday.
+        """
+
+    @abc.abstractmethod
+    async def totals_by_period_for(self, user_ids, start: datetime.date = None, end: datetime.date = None,
+                                   granularity: str = "day"):
+        """totals_by_period for several users in one query, as (user_id, first day number, total) rows."""
+
+    @abc.abstractmethod
+    async def leaderboard(self, window: str, today: datetime.date, limit: int, guild_id: int = None,
+                          after=None):
+        """Return up to ``limit`` (user_id, username, total) rows ranked by total.
+
+        ``after`` is the (total, user_id) of the last row of the previous page.
+        """
+
+    @abc.abstractmethod
+    async def leaderboard_rank(self, user_id: int, window: str, today: datetime.date, guild_id: int = None):
+        """Return (rank, total) for the user in ``window``, or None if they have no playtime in it."""
+
+    @abc.abstractmethod
+    async def get_streak(self, user_id: int):
+        """Return (current, longest) for the user, or None if they never submitted."""
+
+    @abc.abstractmethod
+    async def streak_leaderboard(self, limit: int, active_since: datetime.date = None):
+        """Top (username, days) by longest streak, or by current streak if ``active_since`` is given."""
+
+    @abc.abstractmethod
+    async def rebuild_aggregates(self):
+        """Regenerate every rollup from the raw submissions."""
+
+    # Users
+
+    @abc.abstractmethod
+    async def get_users(self, user_ids):
+        """Return (user_id, username, dm_channel_id, timezone) for those of ``user_ids`` that are known."""
+
+    @abc.abstractmethod
+    async def rename_user(self, user_id: int, username: str):
+        ...
+
+    @abc.abstractmethod
+    async def set_dm_channel(self, user_id: int, channel_id: int):
+        ...
+
+    @abc.abstractmethod
+    async def set_timezone(self, user_id: int, username: str, timezone: str):
+        """Set the IANA timezone the user's days are counted in; None goes back to the server's."""
+
+    # Settings
+
+    @abc.abstractmethod
+    async def get_setting(self, key: str):
+        ...
+
+    @abc.abstractmethod
+    async def set_setting(self, key: str, value: str):
+        ...
+
+    # Goals
+
+    @abc.abstractmethod
+    async def set_goal(self, user_id: int, goal: float):
+        """Set the user's daily goal and queue a goal check for their latest day, which may already meet it."""
+
+    @abc.abstractmethod
+    async def get_goal(self, user_id: int):
+        ...
+
+    @abc.abstractmethod
+    async def claim_goal(self, user_id: int, total: float):
+        """Delete the user's goal if ``total`` meets it, returning the goal that was cleared."""
+
+    @abc.abstractmethod
+    async def claim_met_goals(self, shard_ids=None, shard_count: int = None):
+        """Delete every goal met on its user's local today, returning (user_id, goal, total) for each.
+
+        Only the (user, day) pairs queued in goal_checks are looked at: writes
+        queue one whenever a user with a goal gets playtime, so a sweep's cost
+        follows how many users changed rather than how many have goals. Checks
+        for days before the user's today are dropped; later ones wait for
+        their day. With ``shard_ids``, only users with ``user_id % shard_count``
+        in it are swept. Each goal must be handed out exactly once, even to
+        several processes sweeping at the same time.
+        """
+
+
+def create_storage(url: str = DATABASE_URL) -> Storage:
+    """The Storage for ``url``: PostgreSQL for postgres:// URLs, otherwise a SQLite file path."""
+    if url.startswith(("postgres://", "postgresql://")):
+        from postgres import PostgresDatabase
+        return PostgresDatabase(url)
+    from database import Database
+    return Database(url)
@@ -0,0 +1,96 @@
+"""Fixtures that run each storage test against every backend.
+
+SQLite always runs, on a fresh file per test. PostgreSQL runs on a fresh
+database per test, created on the server in TEST_POSTGRES_URL or, when that
+isn't set, on a throwaway cluster started with initdb and pg_ctl from PATH
+(or PG_BIN). With neither, the PostgreSQL cases are skipped.
+"""
+import asyncio
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import urllib.parse
+import uuid
+import pytest
+from storage import create_storage
+
+TEST_POSTGRES_URL = os.getenv("TEST_POSTGRES_URL")
+PG_BIN = os.getenv("PG_BIN")
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def _admin(server: str, statement: str):
+    import asyncpg
+    conn = await asyncpg.connect(server)
+    try:
+        await conn.execute(statement)
+    finally:
+        await conn.close()
+
+
+@pytest.fixture(scope="session")
+def postgres_server():
+    """URL of a PostgreSQL server the tests may create databases on."""
+    pytest.importorskip("asyncpg")
+    if TEST_POSTGRES_URL:
+        yield TEST_POSTGRES_URL
+        return
+
+    initdb, pg_ctl = shutil.which("initdb", path=PG_BIN), shutil.which("pg_ctl", path=PG_BIN)
+    if initdb is None or pg_ctl is None:
+        pytest.skip("no PostgreSQL: set TEST_POSTGRES_URL, or put initdb and pg_ctl on PATH or in PG_BIN")
+    data = tempfile.mkdtemp(prefix="playtime-pg-")
+    port = _free_port()
+    try:
+        subprocess.run([initdb, "-D", data, "-U", "postgres", "-A", "trust"], check=True, capture_output=True)
+        subprocess.run(
+            [pg_ctl, "-D", data, "-w", "-l", os.path.join(data, "server.log"),
+             "-o", f"-p {port} -k {data} -c listen_addresses=127.0.0.1", "start"],
+            check=True, capture_output=True
+        )
+    except subprocess.CalledProcessError as e:
+        shutil.rmtree(data, ignore_errors=True)
+        pytest.skip(f"couldn't start a PostgreSQL cluster: {e.stderr.decode().strip()}")
+    try:
+        yield f"postgresql://postgres@127.0.0.1:{port}/postgres"
+    finally:
+        subprocess.run([pg_ctl, "-D", data, "-m", "immediate", "stop"], capture_output=True)
+        shutil.rmtree(data, ignore_errors=True)
+
+
+@pytest.fixture(params=["sqlite", "postgresql"])
+def storage_url(request, tmp_path):
+    """DATABASE_URL of an empty database on each backend."""
+    if request.param == "sqlite":
+        yield str(tmp_path / "playtime.db")
+        return
+
+    server = request.getfixturevalue("postgres_server")
+    name = f"playtime_test_{uuid.uuid4().hex}"
+    asyncio.run(_admin(server, f"CREATE DATABASE {name}"))
+    try:
+        yield urllib.parse.urlsplit(server)._replace(path=f"/{name}").geturl()
+    finally:
+        asyncio.run(_admin(server, f"DROP DATABASE {name} WITH (FORCE)"))
+
+
+@pytest.fixture
+def run(storage_url):
+    """Call ``run(body)`` to await ``body(db)`` on an opened Storage for the backend under test."""
+    def run(body):
+        async def main():
+            db = create_storage(storage_url)
+            await db.open()
+            try:
+                return await body(db)
+            finally:
+                await db.close()
+        return asyncio.run(main())
+    return run
@@ -0,0 +1,36 @@
+from cache import ImageCache, cache_key
+
+
+def test_image_cache_evicts_least_recently_used_past_its_byte_cap():
+    cache = ImageCache(max_bytes=10)
+    cache.put("a", b"aaaa")
+    cache.put("b", b"bbbb")
+    assert cache.get("a") == b"aaaa"
+    cache.put("c", b"cccc")
+    # b was used least recently, so it goes to make room.
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c"), cache.size) == (b"aaaa", b"cccc", 8)
+
+
+def test_image_cache_skips_images_bigger_than_the_cap():
+    cache = ImageCache(max_bytes=10)
+    cache.put("a", b"aaaa")
+    cache.put("big", b"x" * 11)
+    assert cache.get("big") is None
+    assert (cache.get("a"), cache.size) == (b"aaaa", 4)
+
+
+def test_image_cache_replacing_a_key_counts_only_the_new_image():
+    cache = ImageCache(max_bytes=10)
+    cache.put("a", b"aaaa")
+    cache.put("b", b"bb")
+    cache.put("a", b"aaaaaa")
+    assert cache.size == 8
+    assert (cache.get("a"), cache.get("b")) == (b"aaaaaa", b"bb")
+    cache.put("a", b"a")
+    assert cache.size == 3
+
+
+def test_cache_key_depends_on_every_part():
+    assert cache_key("graph", 1, 2) == cache_key("graph", 1, 2)
+    assert cache_key("graph", 1, 2) != cache_key("graph", 12)
@@ -0,0 +1,93 @@
+import asyncio
+import datetime
+import sqlite3
+from database import MIGRATIONS, Database
+from metrics import SqlStats, current_sql
+from storage import to_day
+
+
+def test_migrating_a_baseline_file_with_unpadded_dates(tmp_path, capsys):
+    path = str(tmp_path / "playtime.db")
+    # The schema and rows as the original bot wrote them, before PRAGMA user_version was used.
+    conn = sqlite3.connect(path)
+    for statement in MIGRATIONS[0]:
+        conn.execute(statement)
+    conn.executemany(
+        "INSERT INTO playtime (user_id, username, playtime, date) VALUES (?, ?, ?, ?)",
+        [(1, "alice", 1.0, "2025-3-4"), (1, "alice", 2.0, "2025-03-05"), (1, "alice", 0.5, "2025-03-4")],
+    )
+    conn.commit()
+    conn.close()
+
+    async def main():
+        db = Database(path)
+        await db.open()
+        try:
+            assert await db.totals_by_period(1) == [
+                (to_day(datetime.date(2025, 3, 4)), 1.5), (to_day(datetime.date(2025, 3, 5)), 2.0),
+            ]
+            assert await db.get_streak(1) == (2, 2)
+            assert (await db.fetchone("PRAGMA user_version"))[0] == len(MIGRATIONS)
+        finally:
+            await db.close()
+
+    asyncio.run(main())
+    assert f"from schema version 0 to {len(MIGRATIONS)}" in capsys.readouterr().out
+
+
+def test_a_database_built_outside_the_event_loop(tmp_path):
+    # main.py builds its storage at import time, before bot.run() starts the loop.
+    db = Database(str(tmp_path / "playtime.db"), readers=1)
+
+    async def main():
+        await db.open()
+        try:
+            # More of each than there are connections, so some wait on the lock and the reader queue.
+            await asyncio.gather(*(db.set_setting(str(n), "x") for n in range(5)))
+            assert await asyncio.gather(*(db.get_setting(str(n)) for n in range(5))) == ["x"] * 5
+        finally:
+            await db.close()
+
+    asyncio.run(main())
+    asyncio.run(main())
+
+
+def test_a_write_batch_is_charged_to_every_submission_in_it(tmp_path):
+    async def submit(db, user_id):
+        current_sql.set(stats := SqlStats())
+        await db.add_playtime(user_id, f"user{user_id}", 1.0, datetime.date(2025, 3, 3))
+        return stats
+
+    async def main():
+        db = Database(str(tmp_path / "playtime.db"))
+        await db.open()
+        try:
+            return await asyncio.gather(submit(db, 1), submit(db, 2))
+        finally:
+            await db.close()
+
+    first, second = asyncio.run(main())
+    assert first.queries == second.queries == 1
+    assert first.seconds == second.seconds > 0
+
+
+def test_a_cancelled_submission_leaves_the_rest_of_its_batch_alone(tmp_path):
+    async def main():
+        db = Database(str(tmp_path / "playtime.db"))
+        await db.open()
+        try:
+            submissions = [
+                asyncio.ensure_future(db.add_playtime(user_id, f"user{user_id}", 1.0, datetime.date(2025, 3, 3)))
+                for user_id in (1, 2, 3)
+            ]
+            await asyncio.sleep(0)
+            submissions[0].cancel()
+            results = await asyncio.wait_for(asyncio.gather(*submissions, return_exceptions=True), 5)
+            assert isinstance(results[0], asyncio.CancelledError)
+            assert results[1:] == [1.0, 1.0]
+            # It was already queued, so it is committed with the others.
+            assert await db.count_playtime() == 3
+        finally:
+            await db.close()
+
+    asyncio.run(main())
@@ -0,0 +1,47 @@
+import datetime
+from directory import UserDirectory
+from storage import local_today
+
+
+class CountingStorage:
+    """Passes everything through to ``db``, counting get_users calls."""
+
+    def __init__(self, db):
+        self.db = db
+        self.lookups = 0
+
+    def __getattr__(self, name):
+        return getattr(self.db, name)
+
+    async def get_users(self, user_ids):
+        self.lookups += 1
+        return await self.db.get_users(user_ids)
+
+
+def test_misses_are_cached_until_the_user_is_added(run):
+    async def body(db):
+        counting = CountingStorage(db)
+        directory = UserDirectory(counting)
+        await db.add_playtime(1, "alice", 1.0, datetime.date(2025, 3, 3))
+
+        assert await directory.names([1, 2]) == {1: "alice"}
+        assert await directory.today(2) == local_today()
+        assert await directory.names([2]) == {}
+        assert counting.lookups == 1
+
+        await db.add_playtime(2, "bob", 1.0, datetime.date(2025, 3, 3))
+        directory.added(2)
+        directory.added(1)
+        assert await directory.names([1, 2]) == {1: "alice", 2: "bob"}
+        assert counting.lookups == 2
+    run(body)
+
+
+def test_misses_expire_with_the_ttl(run):
+    async def body(db):
+        counting = CountingStorage(db)
+        directory = UserDirectory(counting, ttl=-1)
+        assert await directory.names([1]) == {}
+        assert await directory.names([1]) == {}
+        assert counting.lookups == 2
+    run(body)
@@ -0,0 +1,39 @@
+import asyncio
+import datetime
+import gzip
+import pytest
+from exports import export_rows
+
+COLUMNS = ["User ID", "Username", "Date", "Playtime (hours)"]
+ROWS = [
+    [(1, None, datetime.date(2025, 1, 1), 1.0)],
+    [(2, "bob", datetime.date(2025, 1, 2), 2.5)],
+]
+
+
+def export(fmt: str):
+    async def chunks():
+        for rows in ROWS:
+            yield rows
+    return asyncio.run(export_rows(chunks(), COLUMNS, fmt))
+
+
+def test_csv_export():
+    file, count = export("csv.gz")
+    with file:
+        assert count == 2
+        assert gzip.decompress(file.read()).decode().splitlines() == [
+            "User ID,Username,Date,Playtime (hours)", "1,,2025-01-01,1.0", "2,bob,2025-01-02,2.5",
+        ]
+
+
+def test_parquet_export_when_the_first_chunk_has_no_usernames():
+    pyarrow_parquet = pytest.importorskip("pyarrow.parquet")
+    file, count = export("parquet")
+    with file:
+        table = pyarrow_parquet.read_table(file)
+    assert count == 2
+    assert [str(field.type) for field in table.schema] == ["int64", "string", "date32[day]", "double"]
+    assert table.to_pylist()[1] == {
+        "User ID": 2, "Username": "bob", "Date": datetime.date(2025, 1, 2), "Playtime (hours)": 2.5,
+    }
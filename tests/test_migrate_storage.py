@@ -0,0 +1,40 @@
+import argparse
+import asyncio
+import datetime
+from database import Database
+from migrate_storage import migrate
+from storage import local_today, to_day
+
+
+def test_migrate_copies_everything(run, storage_url, tmp_path):
+    source_path = str(tmp_path / "source.db")
+    zone = "Asia/Tokyo"
+    today = local_today(zone)
+
+    async def seed():
+        source = Database(source_path)
+        await source.open()
+        try:
+            await source.set_timezone(1, "alice", zone)
+            await source.set_goal(1, 3.0)
+            await source.add_playtime(1, "alice", 1.0, today - datetime.timedelta(days=1), guild_id=9)
+            await source.add_playtime(1, "alice", 4.0, today, guild_id=9)
+            await source.add_playtime(2, "bob", 2.0, today)
+            await source.set_dm_channel(2, 77)
+            await source.set_setting("last_sweep", "5")
+        finally:
+            await source.close()
+
+    asyncio.run(seed())
+    asyncio.run(migrate(argparse.Namespace(target=storage_url, source=source_path, batch=2)))
+
+    async def body(db):
+        assert sorted(await db.get_users([1, 2])) == [(1, "alice", None, zone), (2, "bob", 77, None)]
+        assert await db.get_setting("last_sweep") == "5"
+        assert await db.count_playtime() == 3
+        assert await db.totals_by_period(1) == [(to_day(today) - 1, 1.0), (to_day(today), 4.0)]
+        assert await db.get_streak(1) == (2, 2)
+        assert await db.leaderboard("all", today, 10, guild_id=9) == [(1, "alice", 5.0)]
+        # The goal check queued on the source is swept on the target.
+        assert await db.claim_met_goals() == [(1, 3.0, 4.0)]
+    run(body)
@@ -0,0 +1,65 @@
+import datetime
+import numpy as np
+import pytest
+from rendering import ROLLING_WINDOW, apply_mode, dense_matrix, downsample
+
+MONDAY = datetime.date(2025, 3, 3).toordinal()
+
+
+def test_dense_matrix_keeps_the_order_users_were_asked_for_in():
+    rows = [(10, MONDAY, 1.0), (30, MONDAY + 1, 3.0), (20, MONDAY + 3, 2.0), (10, MONDAY + 3, 4.0)]
+    axis, matrix = dense_matrix([30, 10, 20], rows, "day")
+    assert axis.tolist() == [MONDAY, MONDAY + 1, MONDAY + 2, MONDAY + 3]
+    assert matrix.tolist() == [
+        [0, 3.0, 0, 0],
+        [1.0, 0, 0, 4.0],
+        [0, 0, 0, 2.0],
+    ]
+
+
+def test_dense_matrix_week_axis_covers_empty_weeks():
+    rows = [(1, MONDAY, 1.0), (2, MONDAY + 21, 2.0)]
+    axis, matrix = dense_matrix([1, 2], rows, "week")
+    assert axis.tolist() == [MONDAY, MONDAY + 7, MONDAY + 14, MONDAY + 21]
+    assert matrix.tolist() == [[1.0, 0, 0, 0], [0, 0, 0, 2.0]]
+
+
+def test_dense_matrix_month_axis_only_has_months_played():
+    march, may = datetime.date(2025, 3, 1).toordinal(), datetime.date(2025, 5, 1).toordinal()
+    rows = [(2, may, 5.0), (1, march, 1.0), (2, march, 2.0)]
+    axis, matrix = dense_matrix([1, 2], rows, "month")
+    assert axis.tolist() == [march, may]
+    assert matrix.tolist() == [[1.0, 0], [2.0, 5.0]]
+
+
+def test_apply_mode():
+    matrix = np.array([[float(n) for n in range(1, 11)], [0.0] * 9 + [7.0]])
+    assert apply_mode(matrix, "daily") is matrix
+    assert apply_mode(matrix, "cumulative")[0].tolist() == [1, 3, 6, 10, 15, 21, 28, 36, 45, 55]
+
+    rolling = apply_mode(matrix, "rolling")
+    # Until a full window has passed, the average is over the buckets so far.
+    assert rolling[0, :3].tolist() == [1.0, 1.5, 2.0]
+    assert rolling[0, ROLLING_WINDOW - 1] == 4.0
+    assert rolling[0, -1] == np.mean(matrix[0, -ROLLING_WINDOW:])
+    assert rolling[1].tolist() == [0.0] * 9 + [1.0]
+
+
+@pytest.mark.parametrize("n, threshold", [(1000, 20), (1001, 7), (10, 3), (500, 499)])
+def test_downsample_keeps_the_ends_and_peaks(n, threshold):
+    x = np.arange(n, dtype=np.float64)
+    y = np.sin(x / 5)
+    peak = n * 3 // 7
+    y[peak] = 50.0
+    sampled_x, sampled_y = downsample(x, y, threshold)
+    assert len(sampled_x) == len(sampled_y) == threshold
+    assert (sampled_x[0], sampled_x[-1]) == (0, n - 1)
+    assert np.all(np.diff(sampled_x) > 0)
+    assert peak in sampled_x
+    assert np.array_equal(sampled_y, y[sampled_x.astype(np.int64)])
+
+def test_downsample_leaves_short_series_alone():
+    x, y = np.arange(5.0), np.arange(5.0)
+    for threshold in (5, 2):
+        sampled_x, sampled_y = downsample(x, y, threshold)
+        assert sampled_x is x and sampled_y is y
@@ -0,0 +1,257 @@
+import asyncio
+import csv
+import datetime
+import io
+import pytest
+from database import Database
+from exports import export_rows
+from storage import create_storage, from_day, local_today, to_day
+
+MONDAY = datetime.date(2025, 3, 3)
+
+
+def days(n: int) -> datetime.timedelta:
+    return datetime.timedelta(days=n)
+
+
+def test_submissions_update_rollups(run):
+    async def body(db):
+        assert await db.add_playtime(1, "alice", 1.5, MONDAY) == 1.5
+        assert await db.add_playtime(1, "alice", 2.0, MONDAY) == 3.5
+        await db.add_playtime(1, "alice", 4.0, MONDAY + days(8))
+        await db.add_playtime(2, "bob", 0.5, MONDAY + days(1))
+        await db.add_playtime(2, "bob", 1.0, datetime.date(2025, 4, 2))
+
+        assert await db.count_playtime() == 5
+        assert await db.daily_total(1, MONDAY) == 3.5
+        assert await db.daily_total(1, MONDAY + days(1)) == 0
+        assert await db.totals_by_period(1) == [(to_day(MONDAY), 3.5), (to_day(MONDAY) + 8, 4.0)]
+        assert await db.totals_by_period(None, granularity="week") == [
+            (to_day(MONDAY), 4.0), (to_day(MONDAY) + 7, 4.0), (to_day(datetime.date(2025, 3, 31)), 1.0),
+        ]
+        assert await db.totals_by_period(None, granularity="month") == [
+            (to_day(datetime.date(2025, 3, 1)), 8.0), (to_day(datetime.date(2025, 4, 1)), 1.0),
+        ]
+        # Edge buckets only cover the days inside the range.
+        assert await db.totals_by_period(None, MONDAY + days(1), MONDAY + days(8), "week") == [
+            (to_day(MONDAY), 0.5), (to_day(MONDAY) + 7, 4.0),
+        ]
+        assert sorted(await db.totals_by_period_for([1, 2], granularity="month")) == [
+            (1, to_day(datetime.date(2025, 3, 1)), 7.5),
+            (2, to_day(datetime.date(2025, 3, 1)), 0.5),
+            (2, to_day(datetime.date(2025, 4, 1)), 1.0),
+        ]
+
+        await db.rebuild_aggregates()
+        assert await db.totals_by_period(None, granularity="month") == [
+            (to_day(datetime.date(2025, 3, 1)), 8.0), (to_day(datetime.date(2025, 4, 1)), 1.0),
+        ]
+    run(body)
+
+
+def test_backfilled_day_joins_streaks(run):
+    async def body(db):
+        for offset in (0, 1, 3):
+            await db.add_playtime(1, "alice", 1.0, MONDAY + days(offset))
+        assert await db.get_streak(1) == (1, 2)
+
+        await db.add_playtime(1, "alice", 1.0, MONDAY + days(2))
+        assert await db.get_streak(1) == (4, 4)
+        # A second submission on a day already counted changes nothing.
+        await db.add_playtime(1, "alice", 1.0, MONDAY + days(1))
+        assert await db.get_streak(1) == (4, 4)
+
+        await db.add_playtime(2, "bob", 1.0, MONDAY + days(10))
+        assert await db.get_streak(2) == (1, 1)
+        assert await db.get_streak(3) is None
+        assert await db.streak_leaderboard(10) == [("alice", 4), ("bob", 1)]
+        assert await db.streak_leaderboard(10, active_since=MONDAY + days(9)) == [("bob", 1)]
+    run(body)
+
+
+def test_leaderboard_pages_and_ranks(run):
+    async def body(db):
+        totals = {10: 5.0, 11: 3.0, 12: 3.0, 13: 8.0, 14: 1.0}
+        for user_id, hours in totals.items():
+            await db.add_playtime(user_id, f"user{user_id}", hours, MONDAY, guild_id=1 if user_id % 2 else 2)
+        await db.add_playtime(10, "user10", 1.0, MONDAY - days(1))
+        expected = [(13, 8.0), (10, 6.0), (11, 3.0), (12, 3.0), (14, 1.0)]
+
+        pages, after = [], None
+        while rows := await db.leaderboard("all", MONDAY, 2, after=after):
+            pages.append([(user_id, total) for user_id, _, total in rows])
+            after = (rows[-1][2], rows[-1][0])
+        assert pages == [expected[0:2], expected[2:4], expected[4:]]
+
+        ranks = [await db.leaderboard_rank(user_id, "all", MONDAY) for user_id, _ in expected]
+        assert ranks == [(1, 8.0), (2, 6.0), (3, 3.0), (3, 3.0), (5, 1.0)]
+        assert await db.leaderboard_rank(99, "all", MONDAY) is None
+
+        assert await db.leaderboard("all", MONDAY, 10, guild_id=1) == [(13, "user13", 8.0), (11, "user11", 3.0)]
+        assert await db.leaderboard_rank(11, "all", MONDAY, guild_id=1) == (2, 3.0)
+        # Yesterday was in the previous week, so it only counts towards the month.
+        assert (await db.leaderboard("today", MONDAY, 2))[1] == (10, "user10", 5.0)
+        assert (await db.leaderboard("week", MONDAY + days(6), 2))[1] == (10, "user10", 5.0)
+        assert (await db.leaderboard("month", MONDAY, 2))[1] == (10, "user10", 6.0)
+        assert await db.leaderboard("today", MONDAY + days(1), 2) == []
+        with pytest.raises(ValueError):
+            await db.leaderboard("year", MONDAY, 2)
+    run(body)
+
+
+def test_goals_are_claimed_once_per_shard(run):
+    async def body(db):
+        today = local_today()
+        for user_id in (1, 2, 3, 4):
+            await db.set_goal(user_id, 2.0)
+            await db.add_playtime(user_id, f"user{user_id}", 1.0, today)
+        # Met, but on a day that's already over for them.
+        await db.set_goal(5, 1.0)
+        await db.add_playtime(5, "user5", 3.0, today - days(2))
+        for user_id in (1, 2, 3):
+            await db.add_playtime(user_id, f"user{user_id}", 1.5, today)
+
+        assert sorted(await db.claim_met_goals([0], 2)) == [(2, 2.0, 2.5)]
+        assert sorted(await db.claim_met_goals([1], 2)) == [(1, 2.0, 2.5), (3, 2.0, 2.5)]
+        assert await db.claim_met_goals() == []
+        assert [await db.get_goal(user_id) for user_id in (1, 2, 3, 4, 5)] == [None, None, None, 2.0, 1.0]
+
+        # Setting a goal the latest day already meets queues it for the next sweep.
+        await db.set_goal(4, 0.5)
+        assert await db.claim_met_goals() == [(4, 0.5, 1.0)]
+        assert await db.claim_goal(5, 0.5) is None
+        assert await db.claim_goal(5, 1.0) == 1.0
+    run(body)
+
+
+def test_goal_checks_wait_for_the_users_own_day(run):
+    async def body(db):
+        # Kiritimati is UTC+14, so its today is never behind the server's.
+        zone = "Pacific/Kiritimati"
+        ahead = local_today(zone)
+        await db.set_timezone(1, "alice", zone)
+        await db.set_goal(1, 1.0)
+        await db.add_playtime(1, "alice", 2.0, ahead + days(1))
+        assert await db.claim_met_goals() == []
+        assert await db.get_goal(1) == 1.0
+        assert await db.get_users([1, 2]) == [(1, "alice", None, zone)]
+    run(body)
+
+
+def test_bulk_import(run):
+    async def body(db):
+        rows = [
+            (1, "alice", MONDAY, 1.0),
+            (1, "alice", MONDAY + days(1), 2.0),
+            (2, "bob", MONDAY, 0.5),
+        ]
+        assert await db.add_playtime_bulk(rows, guild_id=7) == (3, 0)
+        assert await db.get_streak(1) == (2, 2)
+        assert await db.leaderboard("all", MONDAY, 10, guild_id=7) == [(1, "alice", 3.0), (2, "bob", 0.5)]
+
+        with pytest.raises(ValueError, match="Row 2"):
+            await db.add_playtime_bulk([(3, "carol", MONDAY, 1.0), (3, "carol", MONDAY, -1.0)])
+        assert await db.get_users([3]) == []
+        assert await db.count_playtime() == 3
+    run(body)
+
+
+def test_iter_history(run):
+    async def body(db):
+        await db.add_playtime(1, "alice", 1.0, MONDAY + days(2))
+        await db.add_playtime(2, "bob", 2.0, MONDAY)
+        await db.add_playtime(1, "alice", 3.0, MONDAY)
+        await db.add_playtime(1, "alice", 4.0, MONDAY + days(5))
+
+        chunks = [chunk async for chunk in db.iter_history(chunk_size=3)]
+        assert [len(chunk) for chunk in chunks] == [3, 1]
+        # Everyone's rows come in the order they were submitted.
+        assert [row for chunk in chunks for row in chunk] == [
+            (1, MONDAY + days(2), 1.0), (2, MONDAY, 2.0), (1, MONDAY, 3.0), (1, MONDAY + days(5), 4.0),
+        ]
+        # One user's rows come by date.
+        rows = [row async for chunk in db.iter_history(1, MONDAY, MONDAY + days(3)) for row in chunk]
+        assert rows == [(1, MONDAY, 3.0), (1, MONDAY + days(2), 1.0)]
+        assert [chunk async for chunk in db.iter_history(3)] == []
+    run(body)
+
+
+def test_settings_and_users(run):
+    async def body(db):
+        assert await db.get_setting("last_sweep") is None
+        await db.set_setting("last_sweep", "1")
+        await db.set_setting("last_sweep", "2")
+        assert await db.get_setting("last_sweep") == "2"
+
+        await db.add_playtime(1, "alice", 1.0, MONDAY)
+        await db.rename_user(1, "alicia")
+        await db.set_dm_channel(1, 55)
+        assert await db.get_users([1]) == [(1, "alicia", 55, None)]
+        assert from_day(to_day(MONDAY)) == MONDAY
+    run(body)
+
+
+def test_reimporting_an_export_keeps_every_session(run, tmp_path):
+    # Three sessions of the same length on one day are three submissions, not duplicates.
+    async def export():
+        source = Database(str(tmp_path / "source.db"))
+        await source.open()
+        try:
+            for _ in range(3):
+                await source.add_playtime(1, "alice", 2.0, MONDAY)
+            await source.add_playtime(1, "alice", 1.0, MONDAY + days(1))
+            history = source.iter_history(1)
+            file, _ = await export_rows(([row[1:] for row in rows] async for rows in history), ["Date", "Playtime (hours)"])
+            with file:
+                return list(csv.reader(io.TextIOWrapper(file, encoding="utf-8")))[1:]
+        finally:
+            await source.close()
+
+    exported = asyncio.run(export())
+    rows = [(1, "alice", datetime.date.fromisoformat(date), float(hours)) for date, hours in exported]
+
+    async def body(db):
+        assert await db.add_playtime_bulk(rows) == (4, 0)
+        assert await db.daily_total(1, MONDAY) == 6.0
+        # Importing it again replaces those days rather than adding to them.
+        assert await db.add_playtime_bulk(rows) == (4, 4)
+        assert await db.daily_total(1, MONDAY) == 6.0
+        assert await db.totals_by_period(1) == [(to_day(MONDAY), 6.0), (to_day(MONDAY) + 1, 1.0)]
+        # Days the file doesn't cover are left alone; a covered day takes the file's rows.
+        await db.add_playtime(1, "alice", 2.0, MONDAY + days(2))
+        assert await db.add_playtime_bulk([(1, "alice", MONDAY, 2.0)]) == (1, 3)
+        assert await db.totals_by_period(1) == [
+            (to_day(MONDAY), 2.0), (to_day(MONDAY) + 1, 1.0), (to_day(MONDAY) + 2, 2.0),
+        ]
+        assert await db.get_streak(1) == (3, 3)
+    run(body)
+
+
+def test_data_versions_are_shared_through_the_database(run, storage_url):
+    async def body(db):
+        # A second Storage on the same database stands in for another bot process.
+        other = create_storage(storage_url)
+        await other.open()
+        try:
+            everyone, alice = await db.data_version(), await db.data_version([1])
+            await other.add_playtime(1, "alice", 1.0, MONDAY)
+            assert await db.data_version() != everyone
+            assert await db.data_version([1]) != alice
+            alice = await db.data_version([1])
+
+            both = await db.data_version([1, 2])
+            await db.add_playtime(2, "bob", 1.0, MONDAY)
+            assert await other.data_version([1]) == alice
+            assert await other.data_version([1, 2]) != both
+
+            everyone = await db.data_version()
+            await other.add_playtime_bulk([(1, "alice", MONDAY, 3.0)])
+            assert await db.data_version([1]) != alice
+            assert await db.data_version() != everyone
+            alice, everyone = await db.data_version([1]), await db.data_version()
+            await other.rebuild_aggregates()
+            assert await db.data_version([1]) != alice
+            assert await db.data_version() != everyone
+        finally:
+            await other.close()
+    run(body)
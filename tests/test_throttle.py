@@ -0,0 +1,79 @@
+import asyncio
+import pytest
+from throttle import USER_LIMITS, SingleFlight, parse_limits
+
+
+def test_parse_limits_overrides_defaults():
+    limits = parse_limits(" graph = 2/60, exportdata=0/1 ,", USER_LIMITS)
+    assert limits["graph"] == (2, 60.0)
+    assert limits["exportdata"] == (0, 1.0)
+    assert limits["submit"] == USER_LIMITS["submit"]
+    assert parse_limits(None, USER_LIMITS) == USER_LIMITS
+
+
+@pytest.mark.parametrize("text", ["graph=2/60,bad", "graph=2", "graph=two/60", "graph=2/0", "graph=-1/60", "grpah=2/60"])
+def test_parse_limits_names_the_bad_entry(text):
+    with pytest.raises(ValueError, match=f"GUILD_RATE_LIMITS entry '{text.split(',')[-1]}'"):
+        parse_limits(text, USER_LIMITS, "GUILD_RATE_LIMITS")
+
+
+class Computation:
+    """A compute() for SingleFlight that counts its runs and waits to be released."""
+
+    def __init__(self, result=None, error=None):
+        self.result, self.error = result, error
+        self.runs = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.runs += 1
+        await self.release.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def test_single_flight_shares_one_computation():
+    async def main():
+        flight, compute = SingleFlight(), Computation("png")
+        callers = [asyncio.ensure_future(flight.run("key", compute)) for _ in range(3)]
+        other = asyncio.ensure_future(flight.run("other", compute))
+        await asyncio.sleep(0)
+        compute.release.set()
+        assert await asyncio.gather(*callers, other) == ["png"] * 4
+        assert compute.runs == 2
+        # Once it has finished, the next call computes afresh.
+        assert await flight.run("key", compute) == "png"
+        assert compute.runs == 3
+
+    asyncio.run(main())
+
+
+def test_single_flight_hands_an_error_to_every_caller():
+    async def main():
+        flight, compute = SingleFlight(), Computation(error=ValueError("no data"))
+        callers = [asyncio.ensure_future(flight.run("key", compute)) for _ in range(2)]
+        await asyncio.sleep(0)
+        compute.release.set()
+        results = await asyncio.gather(*callers, return_exceptions=True)
+        assert [str(result) for result in results] == ["no data"] * 2
+        assert all(isinstance(result, ValueError) for result in results)
+        assert compute.runs == 1
+
+    asyncio.run(main())
+
+
+def test_single_flight_survives_a_caller_giving_up():
+    async def main():
+        flight, compute = SingleFlight(), Computation("png")
+        first = asyncio.ensure_future(flight.run("key", compute))
+        second = asyncio.ensure_future(flight.run("key", compute))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        compute.release.set()
+        assert await second == "png"
+        assert first.cancelled()
+        assert compute.runs == 1
+
+    asyncio.run(main())
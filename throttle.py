@@ -0,0 +1,96 @@
+import asyncio
+import os
+from discord import app_commands
+from metrics import metrics
+
+# Each command has a bucket per user and one per guild; a bucket holds `rate`
+# uses and refills `per` seconds after its first use. Override any of these
+# with e.g. RATE_LIMITS="graph=2/60,exportdata=1/600" (per user) and
+# GUILD_RATE_LIMITS="graph=10/60" (per guild); a rate of 0 turns a limit off.
+USER_LIMITS = {
+    "submit": (20, 60),
+    "importdata": (2, 300),
+    "graph": (5, 60),
+    "compare": (5, 60),
+    "leaderboard": (10, 60),
+    "exportdata": (3, 300),
+}
+GUILD_LIMITS = {
+    "graph": (30, 60),
+    "compare": (30, 60),
+    "leaderboard": (60, 60),
+    "exportdata": (10, 300),
+}
+
+
+# Every command rate_limited is applied to.
+LIMITED_COMMANDS = tuple(USER_LIMITS)
+
+
+def parse_limits(text: str, defaults: dict, variable: str = "RATE_LIMITS") -> dict:
+    """Apply ``name=rate/per`` overrides from ``text`` to a copy of ``defaults``.
+
+    Raises a ValueError naming ``variable`` and the entry if one is malformed.
+    """
+    limits = dict(defaults)
+    for item in filter(None, (part.strip() for part in (text or "").split(","))):
+        name, _, limit = (part.strip() for part in item.partition("="))
+        rate, _, per = limit.partition("/")
+        try:
+            rate, per = int(rate), float(per)
+        except ValueError:
+            rate = per = None
+        if name not in LIMITED_COMMANDS or rate is None or rate < 0 or not per > 0:
+            raise ValueError(
+                f"{variable} entry {item!r} should look like name=uses/seconds, with name one of "
+                f"{', '.join(LIMITED_COMMANDS)}, uses a whole number and seconds above 0"
+            )
+        limits[name] = (rate, per)
+    return limits
+
+
+USER_LIMITS = parse_limits(os.getenv("RATE_LIMITS"), USER_LIMITS, "RATE_LIMITS")
+GUILD_LIMITS = parse_limits(os.getenv("GUILD_RATE_LIMITS"), GUILD_LIMITS, "GUILD_RATE_LIMITS")
+
+
+def _cooldown(limits: dict, name: str, per_guild: bool = False):
+    def factory(interaction):
+        rate, per = limits.get(name, (0, 0))
+        # Returning None exempts the interaction; DMs have no guild bucket.
+        if not rate or (per_guild and interaction.guild_id is None):
+            return None
+        return app_commands.Cooldown(rate, per)
+    return factory
+
+
+def rate_limited(name: str):
+    """Stack the per-user and per-guild cooldowns configured for command ``name``.
+
+    A spent bucket fails the check with app_commands.CommandOnCooldown before
+    the command runs, so it costs no database or render work.
+    """
+    def decorator(func):
+        func = app_commands.checks.dynamic_cooldown(_cooldown(GUILD_LIMITS, name, per_guild=True), key=lambda i: i.guild_id)(func)
+        return app_commands.checks.dynamic_cooldown(_cooldown(USER_LIMITS, name), key=lambda i: i.user.id)(func)
+    return decorator
+
+
+class SingleFlight:
+    """Runs at most one computation per key; concurrent callers with the same key share its result.
+
+    The computation runs in its own task, so one caller giving up doesn't
+    cancel it for the others.
+    """
+
+    def __init__(self):
+        self._inflight = {}
+
+    async def run(self, key, compute):
+        """Await ``compute()``, or the already running computation for ``key``."""
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._inflight[key] = asyncio.ensure_future(compute())
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            metrics.increment("playtime_coalesced_requests_total")
+        return await asyncio.shield(task)